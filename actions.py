@@ -0,0 +1,60 @@
+#!/bin/env python3
+
+import numpy as np
+
+import engine
+
+''' Fixed action space for the networks: every move of any position has the same index.
+    start square * 64 + end square (squares are row * 8 + col) for all moves, queen promotions included,
+    then 144 slots for the under promotions: 16 promoting pawn squares x 3 directions x knight, bishop, rook '''
+
+UNDERPROMOTION_BASE = 64 * 64
+UNDERPROMOTIONS = ["N", "B", "R"]
+ACTION_SIZE = UNDERPROMOTION_BASE + 16 * 3 * 3
+
+
+def moveAction(move):
+    if move.isPromotionMove and move.piecePromoted[1] != "Q":
+        pawnSquare = (0 if move.startRow == 1 else 8) + move.startCol  # white promotes from row 1, black from row 6
+        direction = move.endCol - move.startCol + 1
+        return UNDERPROMOTION_BASE + (pawnSquare * 3 + direction) * 3 + UNDERPROMOTIONS.index(move.piecePromoted[1])
+    return (move.startRow * 8 + move.startCol) * 64 + move.endRow * 8 + move.endCol
+
+
+def legalActions(gs):
+    ''' {action: Move} for the legal moves of the position '''
+    return {moveAction(move): move for move in gs.legalMoves()}
+
+
+def legalMask(gs, out=None):
+    ''' Boolean vector of ACTION_SIZE with the legal actions set, written into out if given '''
+    if out is None:
+        out = np.zeros(ACTION_SIZE, dtype=bool)
+    else:
+        out[:] = False
+    out[list(legalActions(gs))] = True
+    return out
+
+
+def actionMove(gs, action):
+    ''' Legal Move of the position for an action, ValueError if it isn't one '''
+    move = legalActions(gs).get(action)
+    if move is None:
+        raise ValueError("action {} is not legal in {}".format(action, gs.toFEN()))
+    return move
+
+
+def actionName(action):
+    ''' Coordinates of an action, e.g. "e7e8n" (the colour is implied by the squares) '''
+    if action < UNDERPROMOTION_BASE:
+        start, end = divmod(action, 64)
+        return engine.packedMove(start | end << 6).moveID
+    index = action - UNDERPROMOTION_BASE
+    pawnSquare, rest = divmod(index, 9)
+    direction, piece = divmod(rest, 3)
+    startRow = 1 if pawnSquare < 8 else 6
+    startCol = pawnSquare % 8
+    endRow = 0 if startRow == 1 else 7
+    code = (startRow * 8 + startCol) | (endRow * 8 + startCol + direction - 1) << 6 | engine.PROMOTION_MOVE << 12 \
+        | engine.PROMOTION_INDEX[UNDERPROMOTIONS[piece]] << 14
+    return engine.packedMove(code).uci
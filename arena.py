@@ -0,0 +1,212 @@
+#!/bin/env python3
+
+import sys
+import math
+import time
+import random
+import itertools
+import multiprocessing as mp
+
+import engine
+
+''' Engine against engine matches without a display, the games spread over a process pool.
+    Players are given as specs, a name and options: "random", "minimax:depth=3", "minimax:time=0.5",
+    "mcts:playouts=200" (uniform priors, no network) or "alpha:model=AlphaZero,playouts=800".
+    Games go in pairs: the same random opening with each player white once. Games still going after maxPlies
+    plies are scored as draws. Results are summed into score and Elo tables with 95% error bars. '''
+
+GAMES = 100
+MAX_PLIES = 300
+OPENING_PLIES = 4  # random plies before the players take over, so deterministic players don't repeat one game
+MAX_PLIES_REACHED = "maxPlies"
+
+
+class RandomPlayer():
+    def __init__(self, seed=0):
+        self.rng = random.Random(seed)
+
+    def newGame(self, seed):
+        self.rng.seed(seed)
+
+    def move(self, gs):
+        moves = gs.legalMoves()
+        return moves[self.rng.randrange(len(moves))]
+
+
+class MinimaxPlayer():
+    def __init__(self, depth=None, time=None, ttMB=16):
+        import minimax_abPrunning as minmax
+        self.minmax = minmax
+        self.depth = int(depth) if depth is not None else None
+        self.time = float(time) if time is not None else None
+        if self.depth is None and self.time is None:
+            self.depth = 3
+        self.tt = minmax.tp.TranspositionTable(int(ttMB))
+
+    def newGame(self, seed):
+        pass
+
+    def move(self, gs):
+        return self.minmax.iterativeDeepening(gs, timeLimit=self.time, maxDepth=self.depth or self.minmax.MAX_PLY, tt=self.tt)
+
+
+class MctsPlayer():
+    ''' model: ChessNet weights file for the priors and values, none for uniform priors '''
+    def __init__(self, playouts=200, model=None):
+        import mcts
+        if model is None:
+            evaluate = mcts.uniform_evaluate
+        else:
+            import torch
+            import inference
+            import neural_reinforcement as nr
+            net = nr.ChessNet(None, {})
+            net.load_state_dict(torch.load(model, map_location="cpu"))
+            evaluate = inference.net_evaluator(net)
+        self.tree = mcts.MCTS(evaluate)
+        self.playouts = int(playouts)
+
+    def newGame(self, seed):
+        pass
+
+    def move(self, gs):
+        return self.tree.best_move(gs, self.playouts)
+
+
+PLAYERS = {"random": RandomPlayer, "minimax": MinimaxPlayer, "mcts": MctsPlayer,
+           "alpha": lambda model="AlphaZero", playouts=800: MctsPlayer(playouts, model)}
+
+
+def makePlayer(spec):
+    ''' Player for a spec like "minimax:depth=3,ttMB=32" '''
+    name, _, options = spec.partition(":")
+    kwargs = dict(option.split("=", 1) for option in options.split(",") if option)
+    return PLAYERS[name](**kwargs)
+
+
+workerPlayers = {}  # spec -> player, made once in each worker process and kept for its next games
+
+
+def player(spec):
+    if spec not in workerPlayers:
+        workerPlayers[spec] = makePlayer(spec)
+    return workerPlayers[spec]
+
+
+def playGame(task):
+    ''' Plays one game, returns (task, result for white 1 / 0.5 / 0, how it ended, UCI moves, seconds) '''
+    white, black, openingSeed, maxPlies, backend = task
+    start = time.time()
+    gs = engine.newGameState(backend)
+    rng = random.Random(openingSeed)
+    players = {True: player(white), False: player(black)}
+    for color, spec in ((True, white), (False, black)):  # a random stream of its own, reproducible like the opening
+        players[color].newGame("{}/{}/{}".format(openingSeed, spec, "white" if color else "black"))
+    status = None
+    while status is None:
+        if len(gs.moveLog) >= maxPlies:
+            status = MAX_PLIES_REACHED
+            break
+        if len(gs.moveLog) < OPENING_PLIES:
+            moves = gs.legalMoves()
+            move = moves[rng.randrange(len(moves))]
+        else:
+            move = players[gs.whiteToMove].move(gs)
+        gs.playMove(move)
+        status = gs.gameStatus()
+    if status == engine.CHECKMATE:
+        result = 0.0 if gs.whiteToMove else 1.0
+    else:
+        result = 0.5
+    moves = [engine.packedMove(move.code).uci for move in gs.moveLog]
+    return task, result, status, moves, time.time() - start
+
+
+def eloDifference(score):
+    score = min(max(score, 1e-6), 1 - 1e-6)
+    return -400 * math.log10(1 / score - 1)
+
+
+def eloInterval(wins, draws, losses, z=1.96):
+    ''' (Elo difference, low, high) of the 95% Wilson interval of the score, which stays wide when every game
+        went the same way (the score variance is then 0) '''
+    n = wins + draws + losses
+    score = (wins + draws / 2) / n
+    center = (score + z * z / (2 * n)) / (1 + z * z / n)
+    margin = z * math.sqrt(score * (1 - score) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return eloDifference(score), eloDifference(center - margin), eloDifference(center + margin)
+
+
+class Match():
+    ''' Round robin of every pair of players, gamesPerPair games each (rounded up to an even number) '''
+    def __init__(self, specs, gamesPerPair=GAMES, maxPlies=MAX_PLIES, processes=None, backend="list", seed=0):
+        self.specs = specs
+        self.gamesPerPair = gamesPerPair + gamesPerPair % 2
+        self.maxPlies = maxPlies
+        self.processes = processes
+        self.backend = backend
+        self.seed = seed
+        self.results = {}  # (a, b) -> [wins, draws, losses] of a against b
+        self.endings = {}  # how the games ended -> count
+        self.records = []  # (UCI moves, result) of every game, for book.writeGames
+        self.plies = 0
+        self.games = 0
+        self.elapsed = 0.0
+
+    def tasks(self):
+        for a, b in itertools.combinations(self.specs, 2):
+            for pair in range(self.gamesPerPair // 2):
+                openingSeed = "{}/{}/{}/{}".format(self.seed, a, b, pair)  # same opening on every run
+                yield (a, b, openingSeed, self.maxPlies, self.backend)
+                yield (b, a, openingSeed, self.maxPlies, self.backend)
+
+    def add(self, task, result, status, moves):
+        white, black = task[0], task[1]
+        for spec, other, score in ((white, black, result), (black, white, 1 - result)):
+            wdl = self.results.setdefault((spec, other), [0, 0, 0])
+            wdl[0 if score == 1 else 1 if score == 0.5 else 2] += 1
+        self.endings[status] = self.endings.get(status, 0) + 1
+        self.records.append((moves, {1.0: "1-0", 0.0: "0-1"}.get(result, "1/2-1/2")))
+        self.plies += len(moves)
+        self.games += 1
+
+    def run(self, progressEvery=20):
+        start = time.time()
+        tasks = list(self.tasks())
+        with mp.Pool(self.processes) as pool:
+            for task, result, status, moves, seconds in pool.imap_unordered(playGame, tasks):
+                self.add(task, result, status, moves)
+                if self.games % progressEvery == 0:
+                    self.elapsed = time.time() - start
+                    print("{}/{} games, {:.2f} games/s".format(self.games, len(tasks), self.games / self.elapsed))
+        self.elapsed = time.time() - start
+        return self
+
+    def report(self):
+        print("{} games in {:.1f}s: {:.2f} games/s, {:.0f} plies/s".format(
+            self.games, self.elapsed, self.games / self.elapsed, self.plies / self.elapsed))
+        print("endings: " + ", ".join("{} {}".format(status, count) for status, count in sorted(self.endings.items(), key=str)))
+        for a, b in itertools.combinations(self.specs, 2):
+            wins, draws, losses = self.results.get((a, b), [0, 0, 0])
+            if not wins + draws + losses:
+                continue
+            elo, low, high = eloInterval(wins, draws, losses)
+            print("{} vs {}: +{} ={} -{}, score {:.1%}, Elo {:+.0f} [{:+.0f}, {:+.0f}]".format(
+                a, b, wins, draws, losses, (wins + draws / 2) / (wins + draws + losses), elo, low, high))
+        print("standings:")
+        totals = []
+        for spec in self.specs:
+            wdl = [sum(self.results.get((spec, other), [0, 0, 0])[i] for other in self.specs if other != spec) for i in range(3)]
+            n = sum(wdl)
+            totals.append(((wdl[0] + wdl[1] / 2) / n if n else 0.0, spec, wdl))
+        for score, spec, (wins, draws, losses) in sorted(totals, reverse=True):
+            print("  {:30} {:6.1%}  +{} ={} -{}".format(spec, score, wins, draws, losses))
+
+
+if __name__ == "__main__":
+    # python arena.py <games per pair> <processes, 0 for all cores> <player> <player> [player...]
+    if len(sys.argv) < 5:
+        print("usage: arena.py <games per pair> <processes> <player> <player> [player...], e.g. arena.py 100 0 random minimax:depth=2")
+    else:
+        match = Match(sys.argv[3:], int(sys.argv[1]), processes=int(sys.argv[2]) or None)
+        match.run().report()
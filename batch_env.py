@@ -0,0 +1,109 @@
+#!/bin/env python3
+
+import sys
+import time
+
+import numpy as np
+
+import engine
+import actions
+
+''' N games played in lockstep for self-play: one step() plays one move in every game and returns
+    (N, ...) arrays the network can take as a batch. Finished games start again on their own. '''
+
+PIECE_CODES = {"--": 0, "wp": 1, "wN": 2, "wB": 3, "wR": 4, "wQ": 5, "wK": 6,
+               "bp": -1, "bN": -2, "bB": -3, "bR": -4, "bQ": -5, "bK": -6}  # same numbers as GameState.boardAsNumbers
+
+# same scale as neural_main: what the player who made the last move of the game gets
+WIN_REWARD = 1000
+DRAW_REWARD = 500
+MAX_PLIES = 400  # games still going after this are stopped and scored as draws
+MAX_PLIES_REACHED = "maxPlies"  # final_status of those games, the others get GameState.gameStatus()
+
+
+def board_codes(gs):
+    return [PIECE_CODES[piece] for row in gs.board for piece in row]
+
+
+class BatchEnv:
+    def __init__(self, num_envs, backend="list", max_plies=MAX_PLIES):
+        self.num_envs = num_envs
+        self.backend = backend
+        self.max_plies = max_plies
+        self.games = [None] * num_envs
+        self.legal = [None] * num_envs  # per game {action: Move} of the current position
+        self.observations = np.zeros((num_envs, 64), dtype=np.int8)
+        self.masks = np.zeros((num_envs, actions.ACTION_SIZE), dtype=bool)
+        self.to_play = np.ones(num_envs, dtype=np.int8)  # 1 white to move, -1 black
+        self.final_status = [None] * num_envs  # how the last finished game of each slot ended
+        self.final_observations = np.zeros((num_envs, 64), dtype=np.int8)  # and its last position
+        self.games_finished = 0
+        self.plies = 0
+        self.reset()
+
+    def reset(self):
+        for i in range(self.num_envs):
+            self.reset_game(i)
+        return self.observations.copy(), self.masks.copy()
+
+    def reset_game(self, i):
+        self.games[i] = engine.newGameState(self.backend)
+        self.update(i)
+
+    def update(self, i):
+        gs = self.games[i]
+        self.observations[i] = board_codes(gs)
+        if self.legal[i]:
+            self.masks[i, list(self.legal[i])] = False
+        self.legal[i] = actions.legalActions(gs)
+        self.masks[i, list(self.legal[i])] = True
+        self.to_play[i] = 1 if gs.whiteToMove else -1
+
+    def step(self, batch_actions):
+        ''' Plays batch_actions[i] in game i, returns (observations, masks, rewards, dones).
+            Rewards are for the player who just moved. Where done is set the game was reset, the observation
+            and mask are already those of the new game and final_status[i] says how the old one ended '''
+        rewards = np.zeros(self.num_envs, dtype=np.float32)
+        dones = np.zeros(self.num_envs, dtype=bool)
+        for i in range(self.num_envs):
+            move = self.legal[i].get(int(batch_actions[i]))
+            if move is None:
+                raise ValueError("game {}: action {} is not legal".format(i, batch_actions[i]))
+            gs = self.games[i]
+            gs.playMove(move)
+            self.plies += 1
+            status = gs.gameStatus()
+            if status is None and len(gs.moveLog) >= self.max_plies:
+                status = MAX_PLIES_REACHED
+            if status is None:
+                self.update(i)
+                continue
+            rewards[i] = WIN_REWARD if status == engine.CHECKMATE else DRAW_REWARD
+            dones[i] = True
+            self.final_status[i] = status
+            self.final_observations[i] = board_codes(gs)
+            self.games_finished += 1
+            self.reset_game(i)
+        return self.observations.copy(), self.masks.copy(), rewards, dones
+
+    def sample_actions(self, rng=np.random):
+        ''' A random legal action for every game '''
+        return np.array([list(legal)[rng.randint(len(legal))] for legal in self.legal])
+
+
+def benchmark(num_envs=16, steps=500, backend="list"):
+    env = BatchEnv(num_envs, backend)
+    start = time.time()
+    for _ in range(steps):
+        env.step(env.sample_actions())
+    elapsed = time.time() - start
+    print("{} games x {} steps: {} plies/s, {} games finished, {:.2f} games/s".format(
+        num_envs, steps, int(env.plies / elapsed), env.games_finished, env.games_finished / elapsed))
+    return env.games_finished / elapsed
+
+
+if __name__ == "__main__":
+    # python batch_env.py [num_envs] [steps] [backend]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 16,
+              int(sys.argv[2]) if len(sys.argv) > 2 else 500,
+              sys.argv[3] if len(sys.argv) > 3 else "list")
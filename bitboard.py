@@ -0,0 +1,332 @@
+#!/bin/env python3
+
+import engine
+
+''' Squares are numbered row * 8 + col, so bit 0 is a8 and bit 63 is h1 (same order as boardAsNumbers) '''
+FULL = (1 << 64) - 1
+FILE_A = sum(1 << (r * 8) for r in range(8))
+FILE_H = FILE_A << 7
+ROWS = [0xFF << (r * 8) for r in range(8)]
+PIECES = ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']
+
+
+def squareBit(r, c):
+    return 1 << (r * 8 + c)
+
+
+def squares(bb):
+    while bb:
+        lsb = bb & -bb
+        yield lsb.bit_length() - 1
+        bb ^= lsb
+
+
+def stepAttacks(steps):
+    table = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        for dr, dc in steps:
+            if 0 <= r + dr <= 7 and 0 <= c + dc <= 7:
+                mask |= squareBit(r + dr, c + dc)
+        table.append(mask)
+    return table
+
+
+KNIGHT_ATTACKS = stepAttacks([(2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1)])
+KING_ATTACKS = stepAttacks([(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)])
+PAWN_ATTACKS = {"w": stepAttacks([(-1, -1), (-1, 1)]), "b": stepAttacks([(1, -1), (1, 1)])}
+
+#rays go outwards from a square, the ones with a positive step walk towards higher square numbers
+DIRECTIONS = [(-1, 0), (0, -1), (-1, -1), (-1, 1), (1, 0), (0, 1), (1, 1), (1, -1)]
+ROOK_DIRECTIONS = [0, 1, 4, 5]
+BISHOP_DIRECTIONS = [2, 3, 6, 7]
+POSITIVE = [False, False, False, False, True, True, True, True]
+RAYS = []
+for dr, dc in DIRECTIONS:
+    rays = []
+    for sq in range(64):
+        r, c = divmod(sq, 8)
+        mask = 0
+        r, c = r + dr, c + dc
+        while 0 <= r <= 7 and 0 <= c <= 7:
+            mask |= squareBit(r, c)
+            r, c = r + dr, c + dc
+        rays.append(mask)
+    RAYS.append(rays)
+SLIDERS = ["B" if d in BISHOP_DIRECTIONS else "R" for d in range(8)]  # the piece besides the queen moving along it
+
+#squares strictly between two squares on one line, 0 when they aren't on one
+BETWEEN = [[0] * 64 for sq in range(64)]
+for sq in range(64):
+    for d in range(8):
+        between = 0
+        for target in squares(RAYS[d][sq]) if POSITIVE[d] else reversed(list(squares(RAYS[d][sq]))):
+            BETWEEN[sq][target] = between
+            between |= 1 << target
+
+
+def slidingAttacks(sq, occupied, directions):
+    attacks = 0
+    for d in directions:
+        ray = RAYS[d][sq]
+        blockers = ray & occupied
+        if blockers:
+            if POSITIVE[d]:
+                blocker = (blockers & -blockers).bit_length() - 1
+            else:
+                blocker = blockers.bit_length() - 1
+            attacks |= ray ^ RAYS[d][blocker]
+        else:
+            attacks |= ray
+    return attacks
+
+
+def rookAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, ROOK_DIRECTIONS)
+
+
+def bishopAttacks(sq, occupied):
+    return slidingAttacks(sq, occupied, BISHOP_DIRECTIONS)
+
+
+class BitboardGameState(engine.GameState):
+    ''' Same interface as engine.GameState but pieces are also kept as one 64 bit integer per piece and colour.
+        self.board is still kept up to date so the UI can draw it '''
+    def __init__(self):
+        super().__init__()
+        self.syncBitboards()
+
+    def loadFEN(self, fen):
+        super().loadFEN(fen)
+        self.syncBitboards()
+
+    def syncBitboards(self):
+        self.bitboards = {piece: 0 for piece in PIECES}
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    self.bitboards[self.board[r][c]] |= squareBit(r, c)
+        self.updateOccupancy()
+
+    def updateOccupancy(self):
+        bb = self.bitboards
+        self.occupancy = {"w": bb["wp"] | bb["wN"] | bb["wB"] | bb["wR"] | bb["wQ"] | bb["wK"],
+                          "b": bb["bp"] | bb["bN"] | bb["bB"] | bb["bR"] | bb["bQ"] | bb["bK"]}
+        self.occupied = self.occupancy["w"] | self.occupancy["b"]
+
+    def movePiece(self, move):
+        super().movePiece(move)
+        self.toggleMove(move, move.piecePromoted if move.isPromotionMove else move.pieceMoved)
+
+    def undoMove(self):
+        move = self.moveLog[-1]
+        super().undoMove()
+        self.toggleMove(move, move.piecePromoted if move.isPromotionMove else move.pieceMoved)
+
+    def toggleMove(self, move, placed):
+        #every bit a move changes, flipped back the same way when it is undone
+        bb = self.bitboards
+        occupancy = self.occupancy
+        color = move.pieceMoved[0]
+        enemy = "b" if color == "w" else "w"
+        start = 1 << (move.startRow * 8 + move.startCol)
+        end = 1 << (move.endRow * 8 + move.endCol)
+        bb[move.pieceMoved] ^= start
+        bb[placed] ^= end
+        occupancy[color] ^= start | end
+        if move.pieceCaptured != "--":
+            bb[move.pieceCaptured] ^= end
+            occupancy[enemy] ^= end
+        if move.isCastleMove:
+            r = move.startRow
+            rook = squareBit(r, 7) | squareBit(r, 5) if move.endCol > move.startCol else squareBit(r, 0) | squareBit(r, 3)
+            bb[color + "R"] ^= rook
+            occupancy[color] ^= rook
+        elif move.isEnPassantMove:
+            pawn = squareBit(move.startRow, move.endCol)
+            bb[enemy + "p"] ^= pawn
+            occupancy[enemy] ^= pawn
+        self.occupied = occupancy["w"] | occupancy["b"]
+
+    def isAttacked(self, sq, color, occupied, removed=0):
+        ''' True if a piece of color attacks sq, pieces in removed are ignored (captured) '''
+        bb = self.bitboards
+        if KNIGHT_ATTACKS[sq] & bb[color + "N"] & ~removed:
+            return True
+        if KING_ATTACKS[sq] & bb[color + "K"]:
+            return True
+        if PAWN_ATTACKS["b" if color == "w" else "w"][sq] & bb[color + "p"] & ~removed:
+            return True
+        if bishopAttacks(sq, occupied) & (bb[color + "B"] | bb[color + "Q"]) & ~removed:
+            return True
+        if rookAttacks(sq, occupied) & (bb[color + "R"] | bb[color + "Q"]) & ~removed:
+            return True
+        return False
+
+    def squareUnderAttack(self, row, col):
+        enemyColor = "b" if self.whiteToMove else "w"
+        return self.isAttacked(row * 8 + col, enemyColor, self.occupied)
+
+    def pseudoLegalMoves(self):
+        return self.generateMoves(FULL, {}, False)
+
+    def generateMoves(self, targets, pins, kingSafe, quiet=True):
+        ''' Moves of the side to move landing on targets (the king's aside), pinned pieces ({square: ray}) stay
+            on their ray. kingSafe: the king only steps to squares that aren't attacked and en passant is checked,
+            so with the targets and pins of checkersAndPins the moves are legal. quiet=False: captures and promotions '''
+        moves = []
+        color = "w" if self.whiteToMove else "b"
+        enemy = "b" if color == "w" else "w"
+        own = self.occupancy[color]
+        bb = self.bitboards
+        targets &= ~own
+        pushTargets = targets if quiet else targets & (ROWS[0] | ROWS[7])
+        if not quiet:
+            targets &= self.occupancy[enemy]
+        self.pawnBitboardMoves(color, pushTargets, targets, pins, kingSafe, moves)
+        for sq in squares(bb[color + "N"]):
+            if sq not in pins:  # a pinned knight can't stay on its ray
+                self.addTargets(sq, KNIGHT_ATTACKS[sq] & targets, moves)
+        for sq in squares(bb[color + "B"] | bb[color + "Q"]):
+            self.addTargets(sq, bishopAttacks(sq, self.occupied) & targets & pins.get(sq, FULL), moves)
+        for sq in squares(bb[color + "R"] | bb[color + "Q"]):
+            self.addTargets(sq, rookAttacks(sq, self.occupied) & targets & pins.get(sq, FULL), moves)
+        for sq in squares(bb[color + "K"]):
+            kingTargets = KING_ATTACKS[sq] & ~own
+            if not quiet:
+                kingTargets &= self.occupancy[enemy]
+            if kingSafe:
+                occupied = self.occupied ^ (1 << sq)  # the king can't hide behind itself from a slider
+                for target in squares(kingTargets):
+                    if self.isAttacked(target, enemy, occupied, 1 << target):
+                        kingTargets ^= 1 << target
+            self.addTargets(sq, kingTargets, moves)
+            if quiet:
+                self.castlingBitboardMoves(sq, color, moves)
+        return moves
+
+    def addTargets(self, sq, targets, moves):
+        r, c = divmod(sq, 8)
+        board = self.board
+        for target in squares(targets):
+            moves.append(engine.Move((c, r), (target & 7, target >> 3), board))
+
+    def pawnBitboardMoves(self, color, pushTargets, captureTargets, pins, kingSafe, moves):
+        pawns = self.bitboards[color + "p"]
+        enemy = self.occupancy["b" if color == "w" else "w"]
+        empty = ~self.occupied & FULL
+        if color == "w":
+            singles = (pawns >> 8) & empty
+            doubles = ((singles & ROWS[5]) >> 8) & empty
+            lefts = ((pawns & ~FILE_A) >> 9) & enemy
+            rights = ((pawns & ~FILE_H) >> 7) & enemy
+            forward, lastRow = -8, 0
+        else:
+            singles = (pawns << 8) & empty
+            doubles = ((singles & ROWS[2]) << 8) & empty
+            lefts = ((pawns & ~FILE_A) << 7) & enemy
+            rights = ((pawns & ~FILE_H) << 9) & enemy
+            forward, lastRow = 8, 7
+        for targets, offset in ((singles & pushTargets, forward), (doubles & pushTargets, 2 * forward),
+                                (lefts & captureTargets, forward - 1), (rights & captureTargets, forward + 1)):
+            for target in squares(targets):
+                start = target - offset
+                if start in pins and not pins[start] & (1 << target):
+                    continue
+                startSq = (start & 7, start >> 3)
+                endSq = (target & 7, target >> 3)
+                if endSq[1] == lastRow:
+                    for piece in engine.PROMOTION_PIECES:
+                        moves.append(engine.Move(startSq, endSq, self.board, False, False, True, color + piece))
+                else:
+                    moves.append(engine.Move(startSq, endSq, self.board))
+        target = self.enPassantLog[-1]
+        if target is not None:
+            r = target[0] - forward // 8
+            for c in (target[1] - 1, target[1] + 1):
+                if 0 <= c <= 7 and pawns & squareBit(r, c):
+                    move = engine.Move((c, r), (target[1], target[0]), self.board, False, True)
+                    if not kingSafe or not self.leavesKingInCheck(move):
+                        moves.append(move)
+
+    def castlingBitboardMoves(self, sq, color, moves):
+        r = 7 if color == "w" else 0
+        if sq != r * 8 + 4:
+            return
+        rights = self.castlingRightsLog[-1]
+        enemy = "b" if color == "w" else "w"
+        kingSide = rights.wKs if color == "w" else rights.bKs
+        queenSide = rights.wQs if color == "w" else rights.bQs
+        if not (kingSide or queenSide) or self.isAttacked(sq, enemy, self.occupied):
+            return
+        rooks = self.bitboards[color + "R"]
+        if kingSide and rooks & squareBit(r, 7) and not self.occupied & (squareBit(r, 5) | squareBit(r, 6)):
+            if not self.isAttacked(sq + 1, enemy, self.occupied) and not self.isAttacked(sq + 2, enemy, self.occupied):
+                moves.append(engine.Move((4, r), (6, r), self.board, True))
+        if queenSide and rooks & squareBit(r, 0) and not self.occupied & (squareBit(r, 1) | squareBit(r, 2) | squareBit(r, 3)):
+            if not self.isAttacked(sq - 1, enemy, self.occupied) and not self.isAttacked(sq - 2, enemy, self.occupied):
+                moves.append(engine.Move((4, r), (2, r), self.board, True))
+
+    def leavesKingInCheck(self, move):
+        ''' Plays the move on the occupancy masks only, no need to make and undo it '''
+        color = move.pieceMoved[0]
+        enemy = "b" if color == "w" else "w"
+        start = squareBit(move.startRow, move.startCol)
+        end = squareBit(move.endRow, move.endCol)
+        occupied = (self.occupied & ~start) | end
+        removed = end if move.pieceCaptured != "--" else 0
+        if move.isEnPassantMove:
+            removed = squareBit(move.startRow, move.endCol)
+            occupied &= ~removed
+        if move.pieceMoved[1] == "K":
+            kingSq = move.endRow * 8 + move.endCol
+        else:
+            kingSq = self.bitboards[color + "K"].bit_length() - 1
+        return self.isAttacked(kingSq, enemy, occupied, removed)
+
+    def checksAndPins(self, kingSq, color):
+        ''' checkers: bitboard of the pieces giving check, pins: {square of an own piece pinned to the king: its ray} '''
+        enemy = "b" if color == "w" else "w"
+        bb = self.bitboards
+        checkers = (KNIGHT_ATTACKS[kingSq] & bb[enemy + "N"]) | (PAWN_ATTACKS[color][kingSq] & bb[enemy + "p"])
+        pins = {}
+        for d in range(8):
+            ray = RAYS[d][kingSq]
+            sliders = ray & (bb[enemy + "Q"] | bb[enemy + SLIDERS[d]])
+            if not sliders:
+                continue
+            blockers = ray & self.occupied
+            first = (blockers & -blockers).bit_length() - 1 if POSITIVE[d] else blockers.bit_length() - 1
+            if sliders & (1 << first):
+                checkers |= 1 << first
+            elif self.occupancy[color] & (1 << first):
+                blockers ^= 1 << first
+                if blockers:
+                    second = (blockers & -blockers).bit_length() - 1 if POSITIVE[d] else blockers.bit_length() - 1
+                    if sliders & (1 << second):
+                        pins[first] = ray
+        return checkers, pins
+
+    def legalBitboardMoves(self, quiet):
+        color = "w" if self.whiteToMove else "b"
+        kingSq = self.bitboards[color + "K"].bit_length() - 1
+        checkers, pins = self.checksAndPins(kingSq, color)
+        if not checkers:
+            targets = FULL
+        elif checkers & (checkers - 1):
+            targets = 0  # double check, only the king can move
+        else:
+            targets = checkers | BETWEEN[kingSq][checkers.bit_length() - 1]  # take the checker or block it
+        return self.generateMoves(targets, pins, True, quiet)
+
+    def generateLegalMoves(self):
+        return self.legalBitboardMoves(True)
+
+    def hasNonPawnMaterial(self):
+        color = "w" if self.whiteToMove else "b"
+        bb = self.bitboards
+        return bool(bb[color + "N"] | bb[color + "B"] | bb[color + "R"] | bb[color + "Q"])
+
+    def legalCaptures(self):
+        return self.legalBitboardMoves(False)
@@ -0,0 +1,169 @@
+#!/bin/env python3
+
+import os
+import sys
+import time
+import random
+
+import numpy as np
+
+import engine
+
+''' Opening book in one file, memory-mapped when opened so nothing is read until a position is looked up:
+    header | keys: sorted zobrist keys, uint64 [positions] | starts: uint32 [positions + 1]
+           | codes: Move.code, uint16 [moves] | weights: uint16 [moves]
+    The moves of keys[i] are codes[starts[i]:starts[i + 1]], a probe is one binary search on keys.
+    Books are built from games given as UCI moves and a result, from files or from finished GameStates. '''
+
+HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("positions", "<u8"), ("moves", "<u8")])
+MAGIC = b"CHBK"
+VERSION = 1
+BOOK_PLIES = 20  # moves of every game that go into the book
+MAX_WEIGHT = 0xFFFF
+# weight a move gets from one game, by the result for the player who made it
+RESULT_WEIGHTS = {"win": 2, "draw": 1, "loss": 0}
+
+
+class OpeningBook():
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        header = self.data[:HEADER.itemsize].view(HEADER)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION:
+            raise ValueError("{} is not an opening book".format(path))
+        self.positions = int(header["positions"])
+        self.numMoves = int(header["moves"])
+        offset = HEADER.itemsize
+        self.keys = self.data[offset:offset + 8 * self.positions].view("<u8")
+        offset += 8 * self.positions
+        self.starts = self.data[offset:offset + 4 * (self.positions + 1)].view("<u4")
+        offset += 4 * (self.positions + 1)
+        self.codes = self.data[offset:offset + 2 * self.numMoves].view("<u2")
+        offset += 2 * self.numMoves
+        self.weights = self.data[offset:offset + 2 * self.numMoves].view("<u2")
+
+    def __len__(self):
+        return self.positions
+
+    def entries(self, key):
+        ''' [(moveCode, weight)] of the position with this key, [] if it isn't in the book '''
+        i = int(np.searchsorted(self.keys, np.uint64(key)))
+        if i == self.positions or int(self.keys[i]) != key:
+            return []
+        start, end = int(self.starts[i]), int(self.starts[i + 1])
+        return list(zip(self.codes[start:end].tolist(), self.weights[start:end].tolist()))
+
+    def probe(self, gs, rng=random):
+        ''' A legal Move of gs picked at random by weight, None when the position isn't in the book '''
+        entries = self.entries(gs.hashKey)
+        if not entries:
+            return None
+        legal = {move.code: move for move in gs.legalMoves()}
+        entries = [(code, weight) for code, weight in entries if code in legal]  # in case of a key collision
+        if not entries:
+            return None
+        code = rng.choices([code for code, weight in entries], [weight for code, weight in entries])[0]
+        return legal[code]
+
+
+def openBook(path):
+    ''' The book in path, None if there is no such file '''
+    return OpeningBook(path) if os.path.exists(path) else None
+
+
+def moveFromUci(gs, uci):
+    for move in gs.legalMoves():
+        if engine.packedMove(move.code).uci == uci:
+            return move
+    return None
+
+
+def gameRecord(gs):
+    ''' (UCI moves, result) of the game played on gs, for buildBook and writeGames '''
+    status = gs.gameStatus()
+    if status == engine.CHECKMATE:
+        result = "0-1" if gs.whiteToMove else "1-0"
+    elif status is not None:
+        result = "1/2-1/2"
+    else:
+        result = "*"
+    return [engine.packedMove(move.code).uci for move in gs.moveLog], result
+
+
+def writeGames(records, path):
+    ''' Appends games to a text file, one per line: the UCI moves then the result '''
+    with open(path, "a") as f:
+        for moves, result in records:
+            f.write(" ".join(moves + [result]) + "\n")
+
+
+def readGames(path):
+    ''' Games of a file written by writeGames (or any file of UCI moves per line, the result is optional) '''
+    with open(path) as f:
+        for line in f:
+            tokens = line.split()
+            if not tokens:
+                continue
+            if tokens[-1] in ("1-0", "0-1", "1/2-1/2", "*"):
+                yield tokens[:-1], tokens[-1]
+            else:
+                yield tokens, "*"
+
+
+def buildBook(games, path, maxPly=BOOK_PLIES, minCount=1, backend="list"):
+    ''' Writes the book of the first maxPly moves of games ((UCI moves, result) pairs), keeping the moves
+        played at least minCount times. Returns (positions, moves) '''
+    counts = {}  # (key, code) -> [games, weight]
+    for moves, result in games:
+        gs = engine.newGameState(backend)
+        for uci in moves[:maxPly]:
+            move = moveFromUci(gs, uci)
+            if move is None:
+                break  # illegal or unknown move, the rest of this game is skipped
+            if result in ("1-0", "0-1"):
+                won = (result == "1-0") == gs.whiteToMove
+                weight = RESULT_WEIGHTS["win" if won else "loss"]
+            else:
+                weight = RESULT_WEIGHTS["draw"]
+            entry = counts.setdefault((gs.hashKey, move.code), [0, 0])
+            entry[0] += 1
+            entry[1] += weight
+            gs.playMove(move)
+    kept = [(key, code, min(weight, MAX_WEIGHT)) for (key, code), (games, weight) in counts.items()
+            if games >= minCount and weight > 0]
+    keys = np.array([k for k, c, w in kept], dtype=np.uint64)
+    codes = np.array([c for k, c, w in kept], dtype=np.uint16)
+    weights = np.array([w for k, c, w in kept], dtype=np.uint16)
+    order = np.lexsort((codes, keys))
+    keys, codes, weights = keys[order], codes[order], weights[order]
+    uniqueKeys, starts = np.unique(keys, return_index=True)
+    starts = np.append(starts, len(keys)).astype("<u4")
+
+    header = np.zeros(1, dtype=HEADER)
+    header[0] = (MAGIC, VERSION, len(uniqueKeys), len(codes))
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for part in (header, uniqueKeys.astype("<u8"), starts, codes.astype("<u2"), weights.astype("<u2")):
+            f.write(part.tobytes())
+    os.replace(tmp, path)
+    return len(uniqueKeys), len(codes)
+
+
+if __name__ == "__main__":
+    # python book.py build <games file> <book file> [maxPly]  |  python book.py probe <book file> [FEN]
+    if len(sys.argv) > 3 and sys.argv[1] == "build":
+        maxPly = int(sys.argv[4]) if len(sys.argv) > 4 else BOOK_PLIES
+        positions, moves = buildBook(readGames(sys.argv[2]), sys.argv[3], maxPly)
+        print("{} positions, {} moves".format(positions, moves))
+    elif len(sys.argv) > 2 and sys.argv[1] == "probe":
+        start = time.perf_counter()
+        book = OpeningBook(sys.argv[2])
+        print("opened {} positions in {:.1f}us".format(len(book), (time.perf_counter() - start) * 1e6))
+        gs = engine.GameState.fromFEN(sys.argv[3]) if len(sys.argv) > 3 else engine.GameState()
+        for code, weight in book.entries(gs.hashKey):
+            print(engine.packedMove(code).uci, weight)
+        start = time.perf_counter()
+        for _ in range(1000):
+            book.probe(gs)
+        print("probe: {:.1f}us".format((time.perf_counter() - start) * 1000))
+    else:
+        print("usage: book.py build <games file> <book file> [maxPly] | book.py probe <book file> [FEN]")
@@ -0,0 +1,160 @@
+#!/bin/env python3
+
+import os
+import sys
+import json
+import uuid
+import shutil
+
+import numpy as np
+
+''' Experience kept on disk: a directory of append-only shards plus index.json listing them.
+    Every shard is one .npy array of RECORD records, written once (to a temporary name, then renamed) and
+    never changed after, so readers can memory-map it and a crash never leaves half a shard in the index.
+    Shard names start with the id of the writer that made them, so datasets from different machines
+    can be merged by copying shards. '''
+
+# one transition, same fields as selfplay.BUFFER_FIELDS (only numpy here, readers don't need the engine)
+RECORD = np.dtype([("states", np.int8, (64,)), ("actions", np.int32), ("next_states", np.int8, (64,)),
+                   ("rewards", np.float32), ("dones", np.bool_)])
+INDEX_FILE = "index.json"
+SHARD_SIZE = 100000  # records per shard
+
+
+def read_index(path):
+    index_path = os.path.join(path, INDEX_FILE)
+    if not os.path.exists(index_path):
+        return {"version": 1, "shards": []}
+    with open(index_path) as f:
+        return json.load(f)
+
+
+def write_index(path, index):
+    tmp = os.path.join(path, INDEX_FILE + ".tmp")
+    with open(tmp, "w") as f:
+        json.dump(index, f, indent=1)
+    os.replace(tmp, os.path.join(path, INDEX_FILE))
+
+
+class DatasetWriter:
+    ''' Appends records to the dataset at path (created if needed), a shard is written every shard_size records
+        and by close(). Only one writer per directory at a time, several machines write several directories '''
+    def __init__(self, path, shard_size=SHARD_SIZE, writer_id=None):
+        self.path = path
+        self.shard_size = shard_size
+        self.writer_id = writer_id or uuid.uuid4().hex[:12]
+        os.makedirs(path, exist_ok=True)
+        self.index = read_index(path)
+        self.pending = np.zeros(shard_size, dtype=RECORD)
+        self.count = 0
+        self.shard_number = sum(1 for shard in self.index["shards"] if shard["name"].startswith(self.writer_id))
+
+    def append(self, states, actions, next_states, rewards, dones):
+        ''' Adds a batch of transitions (arrays of the same length, e.g. one finished game) '''
+        n = len(actions)
+        done = 0
+        while done < n:
+            take = min(n - done, self.shard_size - self.count)
+            block = self.pending[self.count:self.count + take]
+            block["states"] = states[done:done + take]
+            block["actions"] = actions[done:done + take]
+            block["next_states"] = next_states[done:done + take]
+            block["rewards"] = rewards[done:done + take]
+            block["dones"] = dones[done:done + take]
+            self.count += take
+            done += take
+            if self.count == self.shard_size:
+                self.flush()
+
+    def flush(self):
+        if not self.count:
+            return
+        name = "{}-{:06d}.npy".format(self.writer_id, self.shard_number)
+        tmp = os.path.join(self.path, name + ".tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, self.pending[:self.count])
+        os.replace(tmp, os.path.join(self.path, name))
+        self.index["shards"].append({"name": name, "records": int(self.count)})
+        write_index(self.path, self.index)
+        self.shard_number += 1
+        self.count = 0
+
+    def close(self):
+        self.flush()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class Dataset:
+    ''' Read side: shards are memory-mapped when first touched, so the dataset can be much bigger than RAM '''
+    def __init__(self, path):
+        self.path = path
+        self.shards = read_index(path)["shards"]
+        self.offsets = np.cumsum([0] + [shard["records"] for shard in self.shards])
+        self.maps = [None] * len(self.shards)
+
+    def __len__(self):
+        return int(self.offsets[-1])
+
+    def shard(self, i):
+        if self.maps[i] is None:
+            self.maps[i] = np.load(os.path.join(self.path, self.shards[i]["name"]), mmap_mode="r")
+        return self.maps[i]
+
+    def records(self, indices):
+        ''' Records at the given global positions, in that order '''
+        indices = np.asarray(indices)
+        shard_of = np.searchsorted(self.offsets, indices, side="right") - 1
+        out = np.empty(len(indices), dtype=RECORD)
+        for s in np.unique(shard_of):
+            where = np.flatnonzero(shard_of == s)
+            out[where] = self.shard(s)[indices[where] - self.offsets[s]]
+        return out
+
+    def __getitem__(self, i):
+        return self.records([i])[0]
+
+    def sample(self, batch_size, rng=np.random):
+        ''' (states, actions, next_states, rewards, dones) of batch_size random records '''
+        batch = self.records(rng.randint(0, len(self), size=batch_size))
+        return batch["states"], batch["actions"], batch["next_states"], batch["rewards"], batch["dones"]
+
+    def tail(self, n):
+        ''' The last n records (resuming: refill a replay memory with the most recent experience) '''
+        start = max(0, len(self) - n)
+        return self.records(np.arange(start, len(self)))
+
+
+def merge(destination, sources):
+    ''' Copies the shards of the source datasets that destination doesn't have yet, returns how many '''
+    os.makedirs(destination, exist_ok=True)
+    index = read_index(destination)
+    known = {shard["name"] for shard in index["shards"]}
+    copied = 0
+    for source in sources:
+        for shard in read_index(source)["shards"]:
+            if shard["name"] in known:
+                continue
+            tmp = os.path.join(destination, shard["name"] + ".tmp")
+            shutil.copyfile(os.path.join(source, shard["name"]), tmp)
+            os.replace(tmp, os.path.join(destination, shard["name"]))
+            index["shards"].append(shard)
+            known.add(shard["name"])
+            copied += 1
+    write_index(destination, index)
+    return copied
+
+
+if __name__ == "__main__":
+    # python dataset.py merge <destination> <source>...  |  python dataset.py info <path>
+    if len(sys.argv) > 3 and sys.argv[1] == "merge":
+        print("{} shards copied".format(merge(sys.argv[2], sys.argv[3:])))
+    elif len(sys.argv) == 3 and sys.argv[1] == "info":
+        data = Dataset(sys.argv[2])
+        print("{} shards, {} records".format(len(data.shards), len(data)))
+    else:
+        print("usage: dataset.py merge <destination> <source>... | dataset.py info <path>")
@@ -1,10 +1,59 @@
 #!/bin/env python3
 
-import pygame
 import random
-import game
 import numpy as np
-import minimax_abPrunning as minimax
+import pst
+
+
+def attackTable(steps):
+    return [[[(r + dr, c + dc) for dr, dc in steps if 0 <= r + dr <= 7 and 0 <= c + dc <= 7]
+             for c in range(8)] for r in range(8)]
+
+
+def rayTable(directions):
+    rays = [[[] for c in range(8)] for r in range(8)]
+    for r in range(8):
+        for c in range(8):
+            for dr, dc in directions:
+                rays[r][c].append([(r + dr * i, c + dc * i) for i in range(1, 8) if 0 <= r + dr * i <= 7 and 0 <= c + dc * i <= 7])
+    return rays
+
+
+# Computed once at import: the squares a piece on [row][col] attacks
+KNIGHT_ATTACKS = attackTable([(2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1)])
+KING_ATTACKS = attackTable([(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)])
+PAWN_ATTACKS = {"w": attackTable([(-1, -1), (-1, 1)]), "b": attackTable([(1, -1), (1, 1)])}
+# RAYS[row][col][j] walks outwards in DIRECTIONS[j], the first 4 are rook lines and the last 4 bishop lines
+DIRECTIONS = [(-1, 0), (0, -1), (1, 0), (0, 1), (-1, -1), (-1, 1), (1, -1), (1, 1)]
+RAYS = rayTable(DIRECTIONS)
+SLIDERS = [("R", "Q")] * 4 + [("B", "Q")] * 4
+
+# Zobrist keys, the seed is fixed so every process (and every saved table) agrees on them
+zobristRandom = random.Random(20210101)
+ZOBRIST_PIECES = {piece: [[zobristRandom.getrandbits(64) for c in range(8)] for r in range(8)]
+                  for piece in ['wp', 'wN', 'wB', 'wR', 'wQ', 'wK', 'bp', 'bN', 'bB', 'bR', 'bQ', 'bK']}
+ZOBRIST_BLACK_TO_MOVE = zobristRandom.getrandbits(64)
+ZOBRIST_CASTLING = {right: zobristRandom.getrandbits(64) for right in ["wKs", "wQs", "bKs", "bQs"]}
+ZOBRIST_EN_PASSANT = [zobristRandom.getrandbits(64) for c in range(8)]
+
+
+# GameState.gameStatus() values, None while the game goes on
+CHECKMATE = "checkmate"
+STALEMATE = "stalemate"
+REPETITION = "repetition"
+FIFTY_MOVES = "fiftyMoves"
+INSUFFICIENT_MATERIAL = "insufficientMaterial"
+DRAWS = (STALEMATE, REPETITION, FIFTY_MOVES, INSUFFICIENT_MATERIAL)
+
+SEE_VALUES = dict(pst.PIECE_VALUES, K=20000)  # the king can take last, nothing takes it back
+
+
+def castlingHash(castlingRights):
+    key = 0
+    for right, value in castlingRights.__dict__.items():
+        if value:
+            key ^= ZOBRIST_CASTLING[right]
+    return key
 
 
 class GameState():
@@ -26,9 +75,92 @@ class GameState():
         self.moveFunctions = {'p': self.pawnMoves, 'N': self.knightMoves, 'B': self.bishopMoves,
                               'R': self.rockMoves, 'Q': self.queenMoves, 'K': self.kingMoves}
         self.castlingRightsLog = [Castling(True, True, True, True)]
-        self.boardLog = [self.boardCopy()]
+        self.enPassantLog = [None]  # (row, col) a pawn can capture en passant to, like castlingRightsLog one entry per move
         self.fiftyMoves = 0
-        self.canKillPassantLog = []
+        self.fiftyMovesLog = []  # fiftyMoves before each playMove, for goBackMove
+        self.startPly = 0  # plies played before moveLog starts (positions loaded from FEN)
+        self.hashLog = []
+        self.nullMoveLog = []  # len(moveLog) when each null move still on the board was made
+        self.hashKey = self.computeHash()
+        self.evalLog = []
+        self.evalScore = self.computeEvaluation()  # material + piece-square tables, white's point of view
+        self.positionCounts = {self.hashKey: 1}  # hash -> times the position was reached in the game, for repetitions
+        self.positionCache = None  # legal moves, check and status of the current position, see positionInfo
+
+    @classmethod
+    def fromFEN(cls, fen):
+        gs = cls()
+        gs.loadFEN(fen)
+        return gs
+
+    def loadFEN(self, fen):
+        ''' Sets up the position directly: board, side to move, castling, en passant and move counters '''
+        fields = fen.split()
+        pieces = {"p": "p", "n": "N", "b": "B", "r": "R", "q": "Q", "k": "K"}
+        self.board = []
+        for rank in fields[0].split("/"):
+            row = []
+            for char in rank:
+                if char.isdigit():
+                    row += ["--"] * int(char)
+                else:
+                    row.append(("w" if char.isupper() else "b") + pieces[char.lower()])
+            self.board.append(row)
+        if len(self.board) != 8 or any(len(row) != 8 for row in self.board):
+            raise ValueError("bad FEN board: " + fields[0])
+        self.whiteToMove = len(fields) < 2 or fields[1] == "w"
+        castling = fields[2] if len(fields) > 2 else "-"
+        # a right is only kept if the king and the rook are still on their squares
+        self.castlingRightsLog = [Castling("K" in castling and self.board[7][4] == "wK" and self.board[7][7] == "wR",
+                                           "Q" in castling and self.board[7][4] == "wK" and self.board[7][0] == "wR",
+                                           "k" in castling and self.board[0][4] == "bK" and self.board[0][7] == "bR",
+                                           "q" in castling and self.board[0][4] == "bK" and self.board[0][0] == "bR")]
+        passant = fields[3] if len(fields) > 3 else "-"
+        if passant == "-":
+            self.enPassantLog = [None]
+        else:
+            self.enPassantLog = [(Move.rowNotation[passant[1]], Move.colNotation[passant[0]])]
+        self.fiftyMoves = int(fields[4]) if len(fields) > 4 else 0
+        self.fiftyMovesLog = []
+        fullMoves = int(fields[5]) if len(fields) > 5 else 1
+        self.startPly = 2 * (fullMoves - 1) + (0 if self.whiteToMove else 1)
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] == "wK":
+                    self.whiteKingLocation = (c, r)
+                elif self.board[r][c] == "bK":
+                    self.blackKingLocation = (c, r)
+        self.moveLog = []
+        self.undoneMoves = []
+        self.hashLog = []
+        self.nullMoveLog = []
+        self.hashKey = self.computeHash()
+        self.evalLog = []
+        self.evalScore = self.computeEvaluation()
+        self.positionCounts = {self.hashKey: 1}
+        self.positionCache = None
+
+    def toFEN(self):
+        pieces = {"p": "p", "N": "n", "B": "b", "R": "r", "Q": "q", "K": "k"}
+        ranks = []
+        for row in self.board:
+            rank = ""
+            empty = 0
+            for piece in row:
+                if piece == "--":
+                    empty += 1
+                    continue
+                if empty:
+                    rank += str(empty)
+                    empty = 0
+                rank += pieces[piece[1]].upper() if piece[0] == "w" else pieces[piece[1]]
+            ranks.append(rank + (str(empty) if empty else ""))
+        rights = self.castlingRightsLog[-1]
+        castling = ("K" if rights.wKs else "") + ("Q" if rights.wQs else "") + ("k" if rights.bKs else "") + ("q" if rights.bQs else "")
+        target = self.enPassantLog[-1]
+        passant = "-" if target is None else Move.colsToNotation[target[1]] + Move.rowsToNotation[target[0]]
+        fullMoves = (self.startPly + len(self.moveLog)) // 2 + 1
+        return "{} {} {} {} {} {}".format("/".join(ranks), "w" if self.whiteToMove else "b", castling or "-", passant, self.fiftyMoves, fullMoves)
 
     def boardCopy(self):
         return [x[:] for x in self.board]
@@ -53,12 +185,15 @@ class GameState():
         board = np.array([mapBoard[piece] for piece in pieces])
         return board
 
-    def makeMove(self, move):
-        player = game.playerWhite if self.whiteToMove else game.playerBlack
+    def makeMove(self, move, player=None):
+        # player: kind of player making the move (a game.PLAYERS key), it decides how a promotion piece is picked.
+        # Without one the players set in game are asked, importing the UI only then
+        if player is None:
+            import game
+            player = game.playerWhite if self.whiteToMove else game.playerBlack
         moves, movesID = self.getValidMoves()
         print(movesID)
         if move.moveID in movesID and not self.undoneMoves:
-            self.canKillPassantLog.append(self.canKillPassant(moves))
             move.isCastleMove = self.isCastleMove(move, moves)
             move.isEnPassantMove = self.isPassantMove(move, moves)
             move.isPromotionMove = self.isPromotionMove(move, moves)
@@ -67,14 +202,19 @@ class GameState():
             elif move.isPromotionMove and player != "human":
                 move.piecePromoted = self.pickPromotionPiece(player, move)
             print(move.moveID)
-            self.movePiece(move)
-            self.boardLog.append(self.boardCopy())
-            if move.pieceCaptured != "--" or move.pieceMoved[1] == "p":
-                self.fiftyMoves = 0
-            else:
-                self.fiftyMoves += 1
+            self.playMove(move)
             self.piecesInBoard()
 
+    def playMove(self, move):
+        ''' movePiece for a move of the game (not a search): also counts repetitions and the fifty move rule '''
+        self.movePiece(move)
+        self.positionCounts[self.hashKey] = self.positionCounts.get(self.hashKey, 0) + 1
+        self.fiftyMovesLog.append(self.fiftyMoves)
+        if move.pieceCaptured != "--" or move.pieceMoved[1] == "p":
+            self.fiftyMoves = 0
+        else:
+            self.fiftyMoves += 1
+
     def isCastleMove(self, move, moves):
         for i in range(len(moves) - 1, -1, -1):
             if move.moveID == moves[i].moveID:
@@ -94,6 +234,7 @@ class GameState():
         return False
 
     def humanPickPromotionPiece(self):
+        import pygame
         picked = False
         piece = "p"
         while not picked:
@@ -119,6 +260,7 @@ class GameState():
         if player == "random":
             return color + pieces[random.randint(0, 3)]
         if player == "minimax":
+            import minimax_abPrunning as minimax  # the search imports this module, so not at the top
             maxVal = -9999
             pieceToPromote = "-"
             for piece in pieces:
@@ -140,10 +282,20 @@ class GameState():
             self.blackKingLocation = (col, row)
 
     def movePiece(self, move):
+        self.positionCache = None
+        self.hashLog.append(self.hashKey)
+        key = self.hashKey ^ self.enPassantHash() ^ ZOBRIST_BLACK_TO_MOVE
+        key ^= ZOBRIST_PIECES[move.pieceMoved][move.startRow][move.startCol] ^ ZOBRIST_PIECES[move.pieceMoved][move.endRow][move.endCol]
+        self.evalLog.append(self.evalScore)
+        self.evalScore += pst.PIECE_SQUARE[move.pieceMoved][move.endRow][move.endCol] - pst.PIECE_SQUARE[move.pieceMoved][move.startRow][move.startCol]
+        if move.pieceCaptured != "--":
+            key ^= ZOBRIST_PIECES[move.pieceCaptured][move.endRow][move.endCol]
+            self.evalScore -= pst.PIECE_SQUARE[move.pieceCaptured][move.endRow][move.endCol]
         self.board[move.startRow][move.startCol] = "--"
         self.board[move.endRow][move.endCol] = move.pieceMoved
         self.moveLog.append(move)  # append the move so it can be undone later
         self.updateCastlingRights(move)  # store the information about castling rights
+        self.hashKey = key ^ castlingHash(self.castlingRightsLog[-2]) ^ castlingHash(self.castlingRightsLog[-1])
         self.whiteToMove = not self.whiteToMove  # swap players
         if move.pieceMoved[1] == "K":
             self.changeKingLocation(move, move.endCol, move.endRow)
@@ -153,10 +305,19 @@ class GameState():
             self.doPassant(move)
         if move.isPromotionMove:
             self.doPromotion(move)
+        if move.pieceMoved[1] == "p" and abs(move.endRow - move.startRow) == 2:
+            self.enPassantLog.append(((move.startRow + move.endRow) // 2, move.endCol))
+        else:
+            self.enPassantLog.append(None)
+        self.hashKey ^= self.enPassantHash()
 
     def undoMove(self):
+        self.positionCache = None
         move = self.moveLog.pop()
         self.castlingRightsLog.pop()
+        self.enPassantLog.pop()
+        self.hashKey = self.hashLog.pop()
+        self.evalScore = self.evalLog.pop()
         self.board[move.startRow][move.startCol] = move.pieceMoved
         self.board[move.endRow][move.endCol] = move.pieceCaptured
         self.whiteToMove = not self.whiteToMove  # swap players
@@ -167,140 +328,141 @@ class GameState():
         if move.isEnPassantMove:
             self.undoPassant(move)
 
+    def makeNullMove(self):
+        ''' Passes the turn without moving anything (null move pruning), undone by undoNullMove '''
+        self.positionCache = None
+        self.nullMoveLog.append(len(self.moveLog))
+        self.hashLog.append(self.hashKey)
+        self.hashKey ^= self.enPassantHash() ^ ZOBRIST_BLACK_TO_MOVE
+        self.enPassantLog.append(None)
+        self.whiteToMove = not self.whiteToMove
+
+    def undoNullMove(self):
+        self.positionCache = None
+        self.nullMoveLog.pop()
+        self.enPassantLog.pop()
+        self.hashKey = self.hashLog.pop()
+        self.whiteToMove = not self.whiteToMove
+
+    def unwindTo(self, ply):
+        ''' Takes back moves and null moves, in the order they were made, until len(moveLog) == ply '''
+        while len(self.moveLog) > ply or (self.nullMoveLog and self.nullMoveLog[-1] >= ply):
+            if self.nullMoveLog and self.nullMoveLog[-1] == len(self.moveLog):
+                self.undoNullMove()
+            else:
+                self.undoMove()
+
     def goBackMove(self):
+        ''' Takes back the last move of the game to look at the position before it, goForthMove plays it again.
+            Both go through undoMove and playMove, so every log stays in step with moveLog '''
         if len(self.moveLog) > 0:
-            move = self.moveLog.pop()
+            move = self.moveLog[-1]
+            count = self.positionCounts.get(self.hashKey, 0) - 1
+            if count > 0:
+                self.positionCounts[self.hashKey] = count
+            else:
+                self.positionCounts.pop(self.hashKey, None)
+            if self.fiftyMovesLog:
+                self.fiftyMoves = self.fiftyMovesLog.pop()
+            self.undoMove()
             self.undoneMoves.append(move)
-            self.board[move.startRow][move.startCol] = move.pieceMoved
-            self.board[move.endRow][move.endCol] = move.pieceCaptured
-            if move.isCastleMove:
-                self.undoCastling(move.startRow, move.startCol, (move.endCol - move.startCol) // 2, move, move.pieceMoved[0])
-            if move.isEnPassantMove:
-                self.undoPassant(move)
 
     def goForthMove(self):
         if len(self.undoneMoves) > 0:
-            move = self.undoneMoves.pop()
-            self.moveLog.append(move)
-            self.board[move.startRow][move.startCol] = "--"
-            self.board[move.endRow][move.endCol] = move.pieceMoved
-            if move.isCastleMove:
-                self.doCastling(move.startRow, move.startCol, (move.endCol - move.startCol) // 2, move, move.pieceMoved[0])
-            if move.isEnPassantMove:
-                self.doPassant(move)
-            if move.isPromotionMove:
-                self.doPromotion(move)
+            self.playMove(self.undoneMoves.pop())
 
     def allPossibleMoves(self):
+        moves = self.pseudoLegalMoves()
+        return moves, [move.moveID for move in moves]
+
+    def pseudoLegalMoves(self):
         moves = []
-        movesID = []
         for r in range(len(self.board)):
             for c in range(len(self.board[r])):
                 player = self.board[r][c][0]
                 if(player == "w" and self.whiteToMove) or (player == "b" and not self.whiteToMove):
                     piece = self.board[r][c][1]
-                    self.moveFunctions[piece](r, c, moves, movesID)
-        return moves, movesID
+                    self.moveFunctions[piece](r, c, moves)
+        return moves
 
     def possiblePieceMoves(self, r, c):
-        moves = []
-        movesID = []
-        player = self.board[r][c][0]
-        if (player == "w" and self.whiteToMove) or (player == "b" and not self.whiteToMove):
-            piece = self.board[r][c][1]
-            self.moveFunctions[piece](r, c, moves, movesID)
-        for i in range(len(moves)-1, -1, -1): #when removing from a list go backwards through that list:
-            if not self.isValidMove(moves[i]):
-                moves.remove(moves[i])
-                movesID.remove(movesID[i])
-        return moves, movesID
-
-    def pawnMoves(self, r, c, moves, movesID):
+        moves = [move for move in self.legalMoves() if move.startRow == r and move.startCol == c]
+        return moves, [move.moveID for move in moves]
+
+    def pawnMoves(self, r, c, moves):
         if self.whiteToMove: #white pawn moves
             if self.board[r-1][c] == "--":
                 move = Move((c, r), (c, r-1), self.board)
                 moves.append(move)
-                movesID.append(move.moveID)
                 if move.endRow == 0:
-                    self.getPromotionMoves(r, c, moves, movesID, "w")
+                    self.getPromotionMoves(r, c, moves, "w")
                 if r == 6 and self.board[r-2][c] == "--":
                     move = Move((c, r), (c, r-2), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
             if c - 1 >= 0: #capture to left
                 if self.board[r-1][c-1][0] == "b": #enemy to capture
                     move = Move((c, r), (c-1, r-1), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
                     if move.endRow == 0:
-                        self.getPromotionMoves(r, c, moves, movesID, "w")
+                        self.getPromotionMoves(r, c, moves, "w")
             if c + 1 <= 7:  # capture to left
                 if self.board[r-1][c+1][0] == "b":  # enemy to capture
                     move = Move((c, r), (c+1, r-1), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
                     if move.endRow == 0:
-                        self.getPromotionMoves(r, c, moves, movesID, "w")
+                        self.getPromotionMoves(r, c, moves, "w")
             if r == 3:
-                self.getPassantMoves(r, c, moves, movesID)
+                self.getPassantMoves(r, c, moves)
         else: #black pawn moves
             if self.board[r+1][c] == "--":
                 move = Move((c, r), (c, r+1), self.board)
                 moves.append(move)
-                movesID.append(move.moveID)
                 if move.endRow == 7:
-                    self.getPromotionMoves(r, c, moves, movesID, "b")
+                    self.getPromotionMoves(r, c, moves, "b")
                 if r == 1 and self.board[r+2][c] == "--":
                     move = Move((c, r), (c, r+2), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
             if c - 1 >= 0: #capture to left
                 if self.board[r+1][c-1][0] == "w": #enemy to capture
                     move = Move((c, r), (c-1, r+1), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
                     if move.endRow == 7:
-                        self.getPromotionMoves(r, c, moves, movesID, "b")
+                        self.getPromotionMoves(r, c, moves, "b")
             if c + 1 <= 7:  # capture to left
                 if self.board[r+1][c+1][0] == "w":  # enemy to capture
                     move = Move((c, r), (c+1, r+1), self.board)
                     moves.append(move)
-                    movesID.append(move.moveID)
                     if move.endRow == 7:
-                        self.getPromotionMoves(r, c, moves, movesID, "b")
+                        self.getPromotionMoves(r, c, moves, "b")
             if r == 4:
-                self.getPassantMoves(r, c, moves, movesID)
+                self.getPassantMoves(r, c, moves)
 
-    def getPromotionMoves(self, r, c, moves, movesID, color):
+    def getPromotionMoves(self, r, c, moves, color):
         move = moves.pop()
-        movesID.pop()
-        possiblePieces = ["N", "B", "R", "Q"]
-        for piece in possiblePieces:
+        for piece in PROMOTION_PIECES:
             promotionMove = Move((c, r), (move.endCol, move.endRow), self.board, False, False, True, color + piece)
             moves.append(promotionMove)
-            movesID.append(promotionMove.moveID)
 
 
     def doPromotion(self, move):
+        self.hashKey ^= ZOBRIST_PIECES[self.board[move.endRow][move.endCol]][move.endRow][move.endCol] ^ ZOBRIST_PIECES[move.piecePromoted][move.endRow][move.endCol]
+        self.evalScore += pst.PIECE_SQUARE[move.piecePromoted][move.endRow][move.endCol] - pst.PIECE_SQUARE[self.board[move.endRow][move.endCol]][move.endRow][move.endCol]
         self.board[move.endRow][move.endCol] = move.piecePromoted
 
-    def getPassantMoves(self, r, c, moves, movesID):
-        lastMove = self.moveLog[-1]  #will not be empty
-        if r == 3 and lastMove.pieceMoved == "bp":
-            if lastMove.startRow == r-2 and lastMove.endRow == r and (lastMove.endCol == c+1 or lastMove.endCol == c-1):
-                move = Move((c, r), (lastMove.endCol, r - 1), self.board, False, True)
-                moves.append(move)
-                movesID.append(move.moveID)
-        if r == 4 and lastMove.pieceMoved == "wp":
-            if lastMove.startRow == r+2 and lastMove.endRow == r and (lastMove.endCol == c+1 or lastMove.endCol == c-1):
-                move = Move((c, r), (lastMove.endCol, r + 1), self.board, False, True)
-                moves.append(move)
-                movesID.append(move.moveID)
+    def getPassantMoves(self, r, c, moves):
+        target = self.enPassantLog[-1]
+        if target is not None and target[0] == (r - 1 if self.whiteToMove else r + 1) and abs(target[1] - c) == 1:
+            move = Move((c, r), (target[1], target[0]), self.board, False, True)
+            moves.append(move)
 
     def doPassant(self, move):
         if move.startRow == 3:
+            self.hashKey ^= ZOBRIST_PIECES["bp"][move.endRow + 1][move.endCol]
+            self.evalScore -= pst.PIECE_SQUARE["bp"][move.endRow + 1][move.endCol]
             self.board[move.endRow + 1][move.endCol] = "--"
         if move.startRow == 4:
+            self.hashKey ^= ZOBRIST_PIECES["wp"][move.endRow - 1][move.endCol]
+            self.evalScore -= pst.PIECE_SQUARE["wp"][move.endRow - 1][move.endCol]
             self.board[move.endRow - 1][move.endCol] = "--"
 
     def undoPassant(self, move):
@@ -309,13 +471,13 @@ class GameState():
         if move.startRow == 4:
             self.board[move.endRow - 1][move.endCol] = "wp"
 
-    def knightMoves(self, r, c, moves, movesID):
+    def knightMoves(self, r, c, moves):
         enemyColor = "b" if self.whiteToMove else "w"
         knightJumps = [(2, 1), (1, 2), (-1, 2), (-2, 1), (-2, -1), (-1, -2), (1, -2), (2, -1)]
         for jump in knightJumps:
-            self.getMove(r, c, moves, movesID, jump[0], jump[1], enemyColor)
+            self.getMove(r, c, moves, jump[0], jump[1], enemyColor)
 
-    def bishopMoves(self, r, c, moves, movesID):
+    def bishopMoves(self, r, c, moves):
         enemyColor = "b" if self.whiteToMove else "w"
         directions = [(1, 1), (1, -1), (-1, -1), (-1, 1)]
         for dir in directions:
@@ -326,16 +488,14 @@ class GameState():
                     if self.board[endRow][endCol] == "--":
                         move = Move((c, r), (endCol, endRow), self.board)
                         moves.append(move)
-                        movesID.append(move.moveID)
                     elif self.board[endRow][endCol][0] == enemyColor:
                         move = Move((c, r), (endCol, endRow), self.board)
                         moves.append(move)
-                        movesID.append(move.moveID)
                         break
                     else: #Friendly piece
                         break
 
-    def rockMoves(self, r, c, moves, movesID):
+    def rockMoves(self, r, c, moves):
         enemyColor = "b" if self.whiteToMove else "w"
         directions = [(1, 0), (0, -1), (-1, 0), (0, 1)]
         for dir in directions:
@@ -346,36 +506,38 @@ class GameState():
                     if self.board[endRow][endCol] == "--":
                         move = Move((c, r), (endCol, endRow), self.board)
                         moves.append(move)
-                        movesID.append(move.moveID)
                     elif self.board[endRow][endCol][0] == enemyColor:
                         move = Move((c, r), (endCol, endRow), self.board)
                         moves.append(move)
-                        movesID.append(move.moveID)
                         break
                     else:  # Friendly piece
                         break
 
-    def queenMoves(self, r, c, moves, movesID):
-        self.bishopMoves(r, c, moves, movesID)
-        self.rockMoves(r, c, moves, movesID)
+    def queenMoves(self, r, c, moves):
+        self.bishopMoves(r, c, moves)
+        self.rockMoves(r, c, moves)
 
-    def kingMoves(self, r, c, moves, movesID):
+    def kingMoves(self, r, c, moves):
         enemyColor = "b" if self.whiteToMove else "w"
         kingMoves = [(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)]
         for move in kingMoves:
-            self.getMove(r, c, moves, movesID, move[0], move[1], enemyColor)
-        self.getCastlingMoves(r, c, moves, movesID)
+            self.getMove(r, c, moves, move[0], move[1], enemyColor)
+        self.getCastlingMoves(r, c, moves)
 
-    def getCastlingMoves(self, r, c, moves, movesID):
+    def getCastlingMoves(self, r, c, moves):
         if (r == 7 and c == 4) or (r == 0 and c == 4):
                 shortCastle = Move((c, r), (c + 2, r), self.board, True)
                 moves.append(shortCastle)
-                movesID.append(shortCastle.moveID)
                 largeCastle = Move((c, r), (c - 2, r), self.board, True)
                 moves.append(largeCastle)
-                movesID.append(largeCastle.moveID)
 
     def doCastling(self, r, c, x, move, color):
+        rookCol = c + 3 * x if x == 1 else c + 4 * x
+        if self.board[r][rookCol] != "--":
+            self.hashKey ^= ZOBRIST_PIECES[self.board[r][rookCol]][r][rookCol]
+            self.evalScore -= pst.PIECE_SQUARE[self.board[r][rookCol]][r][rookCol]
+        self.hashKey ^= ZOBRIST_PIECES[color + "R"][move.endRow][move.endCol - x]
+        self.evalScore += pst.PIECE_SQUARE[color + "R"][move.endRow][move.endCol - x]
         if x == 1:
             self.board[r][c+3*x] = "--"
             self.board[move.endRow][move.endCol - x] = color + "R"
@@ -391,35 +553,73 @@ class GameState():
             self.board[r][c+4*x] = color + "R"
             self.board[move.endRow][move.endCol - x] = "--"
 
-    def getMove(self, r, c, moves, movesID, x, y, enemyColor):
+    def getMove(self, r, c, moves, x, y, enemyColor):
         if 0 <= r+x <= 7 and 0 <= c+y <= 7:
             if self.board[r+x][c+y] == "--" or self.board[r+x][c+y][0] == enemyColor:
                 move = Move((c, r), (c+y, r+x), self.board)
                 moves.append(move)
-                movesID.append(move.moveID)
 
     def inCheck(self):
+        info = self.positionInfo()
+        if info["inCheck"] is None:
+            info["inCheck"] = self.kingInCheck()
+        return info["inCheck"]
+
+    def kingInCheck(self):
         if self.whiteToMove:
             return self.squareUnderAttack(self.whiteKingLocation[1], self.whiteKingLocation[0])
         else:
             return self.squareUnderAttack(self.blackKingLocation[1], self.blackKingLocation[0])
 
     def inCheckMate(self):
-        return self.inCheck() and self.notMoreMoves()
+        return self.gameStatus() == CHECKMATE
 
     def notMoreMoves(self):
-        moves, movesID = self.getValidMoves()
-        return not moves
+        return not self.positionInfo()["moves"]
 
     def threefoldRepetition(self):
-        lastPosition = self.boardLog[-1]
-        lastCastleRules = self.castlingRightsLog[-1]
-        repeatedTimes = 1
-        for i in range(len(self.boardLog) - 1):
-            if lastPosition == self.boardLog[i] and lastCastleRules.__dict__ == self.castlingRightsLog[i].__dict__ and not self.canKillPassantLog[i]:
-                repeatedTimes += 1  # will be at least 1 cause lastPosition is in boardLog
-                print(repeatedTimes)
-        return repeatedTimes == 3
+        return self.positionCounts.get(self.hashKey, 0) >= 3
+
+    def computeHash(self):
+        ''' Zobrist key from scratch, movePiece and undoMove keep self.hashKey equal to this '''
+        key = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    key ^= ZOBRIST_PIECES[self.board[r][c]][r][c]
+        if not self.whiteToMove:
+            key ^= ZOBRIST_BLACK_TO_MOVE
+        return key ^ castlingHash(self.castlingRightsLog[-1]) ^ self.enPassantHash()
+
+    def computeEvaluation(self):
+        ''' Material + piece-square score from scratch, movePiece and undoMove keep self.evalScore equal to this '''
+        score = 0
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c] != "--":
+                    score += pst.PIECE_SQUARE[self.board[r][c]][r][c]
+        return score
+
+    def enPassantHash(self):
+        # only hashed when a pawn of the side to move stands next to it, otherwise the position is the same
+        target = self.enPassantLog[-1]
+        if target is None:
+            return 0
+        r = target[0] + 1 if self.whiteToMove else target[0] - 1
+        pawn = "wp" if self.whiteToMove else "bp"
+        for c in (target[1] - 1, target[1] + 1):
+            if 0 <= c <= 7 and self.board[r][c] == pawn:
+                return ZOBRIST_EN_PASSANT[target[1]]
+        return 0
+
+    def hasNonPawnMaterial(self):
+        ''' False when the side to move only has its king and pawns, where passing can be the best move (zugzwang) '''
+        color = "w" if self.whiteToMove else "b"
+        for row in self.board:
+            for piece in row:
+                if piece[0] == color and piece[1] in "NBRQ":
+                    return True
+        return False
 
     def insufficientMaterial(self):
         pieces = self.piecesInBoard()
@@ -435,69 +635,258 @@ class GameState():
         return False
 
     def itsDraw(self):
-        return (self.notMoreMoves() and not self.inCheck()) or self.threefoldRepetition() or self.fiftyMoves == 50 or self.insufficientMaterial()
+        return self.gameStatus() in DRAWS
 
-    def canKillPassant(self, moves):
-        for move in moves:
-            if self.isPassantMove(move, moves):
-                return True
-        return False
+    def gameStatus(self):
+        ''' CHECKMATE, one of the DRAWS or None, worked out once per position '''
+        info = self.positionInfo()
+        if "status" not in info:
+            if not info["moves"]:
+                info["status"] = CHECKMATE if self.inCheck() else STALEMATE
+            elif self.threefoldRepetition():
+                info["status"] = REPETITION
+            elif self.fiftyMoves == 50:
+                info["status"] = FIFTY_MOVES
+            elif self.insufficientMaterial():
+                info["status"] = INSUFFICIENT_MATERIAL
+            else:
+                info["status"] = None
+        return info["status"]
+
+    def positionInfo(self):
+        ''' Cache shared by every caller asking about the current position, movePiece, undoMove, goBackMove
+            and goForthMove drop it. The legal moves are generated on the first call, the rest on demand '''
+        info = self.positionCache
+        if info is None or info["key"] != self.hashKey:
+            moves = self.generateLegalMoves()  # may play and undo moves, so the cache is only set afterwards
+            info = self.positionCache = {"key": self.hashKey, "moves": moves, "movesID": None, "inCheck": None}
+        return info
 
     def squareUnderAttack(self, row, col):
-        self.whiteToMove = not self.whiteToMove #switch to opponent's turn
-        oppMoves, oppMovesID = self.allPossibleMoves()
-        self.whiteToMove = not self.whiteToMove #switch back the turns
-        for move in oppMoves:
-            if move.endCol == col and move.endRow == row:
-                return True
-        return False
+        enemyColor = "b" if self.whiteToMove else "w"
+        return self.isAttackedBy(row, col, enemyColor)
 
     def canCastle(self, move):
         castlingRights = self.castlingRightsLog[-1]
-        if move.pieceMoved[0] == "w":
-            if move.startRow == 7 and move.startCol == 4:
-                if move.endRow == 7 and move.endCol == 6:
-                    if self.board[7][5] == "--" and self.board[7][6] == "--":
-                        if not self.inCheck() and not self.squareUnderAttack(7, 5) and not self.squareUnderAttack(7, 6):
-                            return castlingRights.wKs
-                if move.endRow == 7 and move.endCol == 2:
-                    if self.board[7][3] == "--" and self.board[7][2] == "--" and self.board[7][1] == "--":
-                        if not self.inCheck() and not self.squareUnderAttack(7, 3) and not self.squareUnderAttack(7, 2):
-                            return castlingRights.wQs
-        if move.pieceMoved[0] == "b":
-            if move.startRow == 0 and move.startCol == 4:
-                if move.endRow == 0 and move.endCol == 6:
-                    if self.board[0][5] == "--" and self.board[0][6] == "--":
-                        if not self.inCheck() and not self.squareUnderAttack(0, 5) and not self.squareUnderAttack(0, 6):
-                            return castlingRights.bKs
-                if move.endRow == 0 and move.endCol == 2:
-                    if self.board[0][3] == "--" and self.board[0][2] == "--" and self.board[0][1] == "--":
-                        if not self.inCheck() and not self.squareUnderAttack(0, 3) and not self.squareUnderAttack(0, 2):
-                            return castlingRights.bQs
-        return False
+        color = move.pieceMoved[0]
+        r = 7 if color == "w" else 0
+        if move.startRow != r or move.startCol != 4 or move.endRow != r:
+            return False
+        if move.endCol == 6:
+            allowed = castlingRights.wKs if color == "w" else castlingRights.bKs
+            emptyCols, safeCols = (5, 6), (4, 5, 6)
+        elif move.endCol == 2:
+            allowed = castlingRights.wQs if color == "w" else castlingRights.bQs
+            emptyCols, safeCols = (1, 2, 3), (4, 3, 2)
+        else:
+            return False
+        if not allowed:
+            return False
+        for c in emptyCols:
+            if self.board[r][c] != "--":
+                return False
+        enemyColor = "b" if color == "w" else "w"
+        for c in safeCols:  # not in check, not through check and not into check
+            if self.isAttackedBy(r, c, enemyColor):
+                return False
+        return True
 
     def getValidMoves(self):
-        moves, movesID = self.allPossibleMoves()
-        for i in range(len(moves)-1, -1, -1): #when removing from a list go backwards through that list
-            if moves[i].isCastleMove:
-                if not self.canCastle(moves[i]):
-                    moves.remove(moves[i])
-                    movesID.remove(movesID[i])
-            else:
-                # check that your king is not in check in next move
-                self.movePiece(moves[i])
-                self.whiteToMove = not self.whiteToMove
-                if self.inCheck():
-                    moves.remove(moves[i])
-                    movesID.remove(movesID[i])
-                self.whiteToMove = not self.whiteToMove
-                self.undoMove()
-        return moves, movesID
+        info = self.positionInfo()
+        if info["movesID"] is None:
+            info["movesID"] = [move.moveID for move in info["moves"]]
+        return list(info["moves"]), list(info["movesID"])
+
+    def getValidMoveCodes(self):
+        return [move.code for move in self.positionInfo()["moves"]]
+
+    ''' Legal moves without their notation, what the search and perft use. A copy, callers can reorder it '''
+    def legalMoves(self):
+        return list(self.positionInfo()["moves"])
+
+    def generateLegalMoves(self):
+        color = "w" if self.whiteToMove else "b"
+        kingCol, kingRow = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        checks, pins = self.checksAndPins(kingRow, kingCol, color)
+        if checks:
+            return self.getCheckEvasions(kingRow, kingCol, color, checks, pins)
+        return [move for move in self.pseudoLegalMoves() if self.isLegalCandidate(move, kingRow, kingCol, pins, None)]
+
+    def legalCaptures(self):
+        ''' Legal captures and promotions only (quiescence search), the quiet moves are never checked '''
+        color = "w" if self.whiteToMove else "b"
+        kingCol, kingRow = self.whiteKingLocation if self.whiteToMove else self.blackKingLocation
+        checks, pins = self.checksAndPins(kingRow, kingCol, color)
+        if checks:
+            return [move for move in self.legalMoves() if move.isCapture() or move.isPromotionMove]
+        return [move for move in self.pseudoLegalMoves()
+                if (move.isCapture() or move.isPromotionMove) and self.isLegalCandidate(move, kingRow, kingCol, pins, None)]
+
+    def getCheckEvasions(self, kingRow, kingCol, color, checks, pins):
+        moves = []
+        blockSquares = None
+        if len(checks) == 1:  # double check -> only the king can move
+            r, c, dr, dc = checks[0]
+            blockSquares = {(r, c)}
+            if dr != 0 or dc != 0:  # sliding checker, it can also be blocked
+                for i in range(1, 8):
+                    if (kingRow + dr * i, kingCol + dc * i) == (r, c):
+                        break
+                    blockSquares.add((kingRow + dr * i, kingCol + dc * i))
+        enemyColor = "b" if color == "w" else "w"
+        kingSteps = [(1, 1), (1, 0), (1, -1), (0, -1), (-1, -1), (-1, 0), (-1, 1), (0, 1)]
+        for r in range(8):
+            for c in range(8):
+                if self.board[r][c][0] != color:
+                    continue
+                pieceMoves = []
+                if self.board[r][c][1] == "K":
+                    for step in kingSteps:  # castling out of check is never possible
+                        self.getMove(r, c, pieceMoves, step[0], step[1], enemyColor)
+                elif blockSquares is not None and (r, c) not in pins:  # a pinned piece can't stop a check
+                    self.moveFunctions[self.board[r][c][1]](r, c, pieceMoves)
+                else:
+                    continue
+                for move in pieceMoves:
+                    if self.isLegalCandidate(move, kingRow, kingCol, pins, blockSquares):
+                        moves.append(move)
+        return moves
+
+    def isLegalCandidate(self, move, kingRow, kingCol, pins, blockSquares):
+        if move.isCastleMove:
+            return blockSquares is None and self.canCastle(move)
+        if move.pieceMoved[1] == "K":
+            enemyColor = "b" if move.pieceMoved[0] == "w" else "w"
+            self.board[kingRow][kingCol] = "--"  # the king can't hide behind itself from a slider
+            attacked = self.isAttackedBy(move.endRow, move.endCol, enemyColor)
+            self.board[kingRow][kingCol] = move.pieceMoved
+            return not attacked
+        if move.isEnPassantMove:
+            # two pawns leave the same row, too rare to be worth anything smarter than playing it
+            self.movePiece(move)
+            self.whiteToMove = not self.whiteToMove
+            check = self.kingInCheck()
+            self.whiteToMove = not self.whiteToMove
+            self.undoMove()
+            return not check
+        if (move.startRow, move.startCol) in pins:
+            dr, dc = pins[(move.startRow, move.startCol)]
+            if (move.endRow - kingRow) * dc != (move.endCol - kingCol) * dr:  # leaves the pin line
+                return False
+        if blockSquares is not None and (move.endRow, move.endCol) not in blockSquares:
+            return False
+        return True
+
+    def checksAndPins(self, kingRow, kingCol, color):
+        ''' checks: (row, col, dr, dc) of every piece giving check, dr = dc = 0 for knights and pawns
+            pins: {(row, col): (dr, dc)} of own pieces pinned to the king, (dr, dc) is the pin line '''
+        enemyColor = "b" if color == "w" else "w"
+        checks = []
+        pins = {}
+        rays = RAYS[kingRow][kingCol]
+        for j in range(8):
+            possiblePin = None
+            for r, c in rays[j]:
+                piece = self.board[r][c]
+                if piece == "--":
+                    continue
+                if piece[0] == color:
+                    if possiblePin is not None:
+                        break
+                    possiblePin = (r, c)
+                else:
+                    if piece[1] in SLIDERS[j]:
+                        if possiblePin is None:
+                            checks.append((r, c) + DIRECTIONS[j])
+                        else:
+                            pins[possiblePin] = DIRECTIONS[j]
+                    break
+        for r, c in KNIGHT_ATTACKS[kingRow][kingCol]:
+            if self.board[r][c] == enemyColor + "N":
+                checks.append((r, c, 0, 0))
+        for r, c in PAWN_ATTACKS[color][kingRow][kingCol]:  # a pawn checks from where our pawn would capture
+            if self.board[r][c] == enemyColor + "p":
+                checks.append((r, c, 0, 0))
+        return checks, pins
+
+    def isAttackedBy(self, row, col, enemyColor):
+        ''' Looks outwards from the square and stops at the first attacker found '''
+        color = "b" if enemyColor == "w" else "w"
+        board = self.board
+        for r, c in KNIGHT_ATTACKS[row][col]:
+            if board[r][c] == enemyColor + "N":
+                return True
+        for r, c in PAWN_ATTACKS[color][row][col]:
+            if board[r][c] == enemyColor + "p":
+                return True
+        for r, c in KING_ATTACKS[row][col]:
+            if board[r][c] == enemyColor + "K":
+                return True
+        rays = RAYS[row][col]
+        for j in range(8):
+            for r, c in rays[j]:
+                piece = board[r][c]
+                if piece != "--":
+                    if piece[0] == enemyColor and piece[1] in SLIDERS[j]:
+                        return True
+                    break
+        return False
+
+    def attackersOf(self, row, col, enemyColor):
+        ''' List of (row, col) of every enemyColor piece attacking the square '''
+        color = "b" if enemyColor == "w" else "w"
+        board = self.board
+        attackers = [(r, c) for r, c in KNIGHT_ATTACKS[row][col] if board[r][c] == enemyColor + "N"]
+        attackers += [(r, c) for r, c in PAWN_ATTACKS[color][row][col] if board[r][c] == enemyColor + "p"]
+        attackers += [(r, c) for r, c in KING_ATTACKS[row][col] if board[r][c] == enemyColor + "K"]
+        rays = RAYS[row][col]
+        for j in range(8):
+            for r, c in rays[j]:
+                piece = board[r][c]
+                if piece != "--":
+                    if piece[0] == enemyColor and piece[1] in SLIDERS[j]:
+                        attackers.append((r, c))
+                    break
+        return attackers
+
+    def staticExchange(self, move):
+        ''' Material (centipawns) the mover ends up with if both sides keep recapturing on the end square
+            with their least valuable piece and stop when it stops paying, without playing any move '''
+        board = self.board
+        row, col = move.endRow, move.endCol
+        emptied = [(move.startRow, move.startCol, move.pieceMoved)]
+        captured = move.pieceCaptured[1] if move.pieceCaptured != "--" else None
+        if move.isEnPassantMove:
+            captured = "p"
+            emptied.append((move.startRow, move.endCol, board[move.startRow][move.endCol]))
+        gains = [SEE_VALUES[captured] if captured else 0]
+        onSquare = SEE_VALUES[move.pieceMoved[1]]
+        if move.isPromotionMove:
+            gains[0] += SEE_VALUES[move.piecePromoted[1]] - SEE_VALUES["p"]
+            onSquare = SEE_VALUES[move.piecePromoted[1]]
+        for r, c, piece in emptied:
+            board[r][c] = "--"
+        color = "b" if move.pieceMoved[0] == "w" else "w"
+        while True:
+            attackers = self.attackersOf(row, col, color)  # pieces already used are off the board, x-rays show up
+            if not attackers:
+                break
+            r, c = min(attackers, key=lambda square: SEE_VALUES[board[square[0]][square[1]][1]])
+            gains.append(onSquare - gains[-1])
+            onSquare = SEE_VALUES[board[r][c][1]]
+            emptied.append((r, c, board[r][c]))
+            board[r][c] = "--"
+            color = "b" if color == "w" else "w"
+        for r, c, piece in reversed(emptied):
+            board[r][c] = piece
+        for i in range(len(gains) - 1, 0, -1):  # each side can stop capturing
+            gains[i - 1] = -max(-gains[i - 1], gains[i])
+        return gains[0]
 
     def isValidMove(self, move):
-        moves, movesID = self.getValidMoves()
-        for id in movesID:
-            if move.moveID == id:
+        code = move.code & 0xFFF  # flags aren't set yet on a move built from clicks
+        for validMove in self.positionInfo()["moves"]:
+            if validMove.code & 0xFFF == code:
                 return True
         return False
 
@@ -509,23 +898,25 @@ class GameState():
         elif move.pieceMoved == "bK":
             castlingRights.bKs = False
             castlingRights.bQs = False
-        elif move.pieceMoved == "wR":
-            if move.startRow == 7 and move.startCol == 7:
+        # a rook leaving its corner or being captured there loses that side
+        for row, col in ((move.startRow, move.startCol), (move.endRow, move.endCol)):
+            if row == 7 and col == 7:
                 castlingRights.wKs = False
-            elif move.startRow == 0 and move.startCol == 7:
+            elif row == 7 and col == 0:
                 castlingRights.wQs = False
-        elif move.pieceMoved == "bR":
-            if move.startRow == 7 and move.startCol == 0:
+            elif row == 0 and col == 7:
                 castlingRights.bKs = False
-            elif move.startRow == 0 and move.startCol == 0:
+            elif row == 0 and col == 0:
                 castlingRights.bQs = False
         self.castlingRightsLog.append(castlingRights)
 
-    ''' At depth 5 takes a bit of time '''
+    ''' At depth 5 takes a bit of time, perft.py has faster options (hash table, several processes) '''
     def countPositions(self, depth):
         if depth == 0:
             return 1
-        moves, movesID = self.getValidMoves()
+        moves = self.legalMoves()
+        if depth == 1:  # the moves are legal, no need to play them to count them
+            return len(moves)
         totalPos = 0
         for move in moves:
             self.movePiece(move)
@@ -534,8 +925,7 @@ class GameState():
         return totalPos
 
     def getValidMoveIndexes(self):
-        moves, movesID = self.getValidMoves()
-        return [i for i in range(len(moves))]
+        return [i for i in range(len(self.legalMoves()))]
 
     def getBoardSize(self):
         return len(self.board), len(self.board)
@@ -545,8 +935,14 @@ class GameState():
 
 
     def getActionSize(self):
-        moves, movesID = self.getValidMoves()
-        return len(moves)
+        return len(self.legalMoves())
+
+def newGameState(backend="list"):
+    if backend == "bitboard":
+        import bitboard  # imported here because bitboard builds on this module
+        return bitboard.BitboardGameState()
+    return GameState()
+
 
 class Castling():
     def __init__(self, wKs, wQs, bKs, bQs):
@@ -556,7 +952,18 @@ class Castling():
         self.bQs = bQs
 
 
+# 16 bit move codes: start square | end square << 6 | flag << 12 | promoted piece << 14, squares are row * 8 + col
+NORMAL_MOVE = 0
+PROMOTION_MOVE = 1
+EN_PASSANT_MOVE = 2
+CASTLE_MOVE = 3
+PROMOTION_PIECES = ["N", "B", "R", "Q"]
+PROMOTION_INDEX = {piece: i for i, piece in enumerate(PROMOTION_PIECES)}
+
+
 class Move():
+    __slots__ = ("startRow", "startCol", "endRow", "endCol", "pieceMoved", "pieceCaptured",
+                 "isCastleMove", "isEnPassantMove", "isPromotionMove", "piecePromoted", "_moveID")
     rowNotation = {"1": 7, "2": 6, "3": 5, "4": 4,
                    "5": 3, "6": 2, "7": 1, "8": 0}
     rowsToNotation = {v: k for k, v in rowNotation.items()}
@@ -571,14 +978,90 @@ class Move():
         self.endCol = endSq[0]
         self.pieceMoved = board[self.startRow][self.startCol]
         self.pieceCaptured = board[self.endRow][self.endCol]
-        self.moveID = self.getChessNotation()
         self.isCastleMove = isCastle
         self.isEnPassantMove = isEnPassant
         self.isPromotionMove = isPromotion
         self.piecePromoted = piecePromoted
+        self._moveID = None
+
+    @classmethod
+    def fromCode(cls, code, board):
+        ''' Move for a 16 bit code in the position on board '''
+        start = code & 63
+        end = (code >> 6) & 63
+        flag = (code >> 12) & 3
+        piecePromoted = "--"
+        if flag == PROMOTION_MOVE:
+            piecePromoted = board[start >> 3][start & 7][0] + PROMOTION_PIECES[code >> 14]
+        return cls((start & 7, start >> 3), (end & 7, end >> 3), board,
+                   flag == CASTLE_MOVE, flag == EN_PASSANT_MOVE, flag == PROMOTION_MOVE, piecePromoted)
+
+    @property
+    def moveID(self):
+        # only built when asked for, most generated moves never need it
+        if self._moveID is None:
+            self._moveID = self.getChessNotation()
+        return self._moveID
+
+    @property
+    def code(self):
+        code = (self.startRow * 8 + self.startCol) | (self.endRow * 8 + self.endCol) << 6
+        if self.isPromotionMove:
+            return code | PROMOTION_MOVE << 12 | PROMOTION_INDEX[self.piecePromoted[1]] << 14
+        if self.isEnPassantMove:
+            return code | EN_PASSANT_MOVE << 12
+        if self.isCastleMove:
+            return code | CASTLE_MOVE << 12
+        return code
+
+    def isCapture(self):
+        return self.pieceCaptured != "--" or self.isEnPassantMove
 
     def getChessNotation(self):
         return self.getSquare(self.startRow, self.startCol) + self.getSquare(self.endRow, self.endCol)
 
     def getSquare(self, r, c):
-        return self.colsToNotation[c] + self.rowsToNotation[r]
\ No newline at end of file
+        return self.colsToNotation[c] + self.rowsToNotation[r]
+
+
+class PackedMove():
+    ''' Read only view of a move code for code that keeps moves without a board (tables, books, policy
+        indexes). Get them with packedMove(code), there is a single object per code '''
+    __slots__ = ("code", "startRow", "startCol", "endRow", "endCol", "flag", "promotion")
+
+    def __init__(self, code):
+        start = code & 63
+        end = (code >> 6) & 63
+        flag = (code >> 12) & 3
+        for name, value in (("code", code), ("startRow", start >> 3), ("startCol", start & 7),
+                            ("endRow", end >> 3), ("endCol", end & 7), ("flag", flag),
+                            ("promotion", PROMOTION_PIECES[code >> 14] if flag == PROMOTION_MOVE else None)):
+            object.__setattr__(self, name, value)
+
+    def __setattr__(self, name, value):
+        raise AttributeError("PackedMove is read only")
+
+    def __repr__(self):
+        return "PackedMove({})".format(self.uci)
+
+    @property
+    def moveID(self):
+        return Move.colsToNotation[self.startCol] + Move.rowsToNotation[self.startRow] + \
+            Move.colsToNotation[self.endCol] + Move.rowsToNotation[self.endRow]
+
+    @property
+    def uci(self):
+        return self.moveID + (self.promotion.lower() if self.promotion else "")
+
+    def toMove(self, board):
+        return Move.fromCode(self.code, board)
+
+
+packedMoves = {}
+
+
+def packedMove(code):
+    move = packedMoves.get(code)
+    if move is None:
+        move = packedMoves[code] = PackedMove(code)
+    return move
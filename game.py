@@ -12,9 +12,8 @@ import random
 
 import engine
 import minimax_abPrunning as minmax
-import neural_reinforcement as nr
-import torch
-from torch import nn
+import mcts
+import book
 
 
 WIDTH = HEIGHT = 512
@@ -22,17 +21,23 @@ DIMENSION = 8  #dimension of chess board is 8x8
 SQ_SIZE = HEIGHT // DIMENSION
 MAX_FPS = 30
 IMAGES = {}
-screen = pygame.display.set_mode((WIDTH, HEIGHT))
-clock = pygame.time.Clock()
+screen = None  # the window and clock are made in main, importing this module opens nothing
+clock = None
 playerWhite = "random"
 playerBlack = "alpha"
+backend = "list"  # "list" or "bitboard", see engine.newGameState
+MINIMAX_TIME = 2.0  # seconds the minimax player thinks per move
+MCTS_PLAYOUTS = 800  # playouts of the alpha player per move
+searchTree = None  # the alpha player's tree, kept between its moves
+BOOK_FILE = "book.bin"  # opening book (book.py) of the minimax and alpha players, used when the file exists
+openingBook = None
 
 args = {
     'lr': 0.001,
     'dropout': 0.3,
     'epochs': 10,
     'batch_size': 64,
-    'cuda': torch.cuda.is_available(),
+    'cuda': None,  # set in main, torch is only imported when a game is played
     'num_channels': 512,
 }
 
@@ -44,11 +49,16 @@ def loadImages():
 
 
 def main():
+    global screen, clock
+    import torch
+    from torch import nn
+    import neural_reinforcement as nr
     pygame.init()
-    #screen = pygame.display.set_mode((WIDTH, HEIGHT))
-    #clock = pygame.time.Clock()
+    screen = pygame.display.set_mode((WIDTH, HEIGHT))
+    clock = pygame.time.Clock()
+    args['cuda'] = torch.cuda.is_available()
     screen.fill(pygame.Color('white'))
-    gs = engine.GameState()
+    gs = engine.newGameState(backend)
     loadImages()
     pygame.display.set_caption("Chess board")
     running = True
@@ -110,7 +120,7 @@ def humanPlay(gs):
                     playerClicks.append(sqSelected)  # append 1st and 2nd clicks
                 if len(playerClicks) == 2:
                     move = engine.Move(playerClicks[0], playerClicks[1], gs.board)
-                    gs.makeMove(move)
+                    gs.makeMove(move, "human")
                     #sqSelected = ()  # reset user clicks
                     #playerClicks = []
                     moved = True
@@ -125,17 +135,28 @@ def humanPlay(gs):
 def randomPlay(gs):
     moves, movesID = gs.getValidMoves()
     move = moves[random.randint(0, len(moves) - 1)]
-    gs.makeMove(move)
+    gs.makeMove(move, "random")
+
+def bookMove(gs):
+    # the opening book is opened (memory-mapped) on the first probe, None out of the book or without one
+    global openingBook
+    if openingBook is None:
+        openingBook = book.openBook(BOOK_FILE) or False
+    return openingBook.probe(gs) if openingBook else None
 
 def minimaxPlay(gs):
-    move = minmax.minimaxRoot(3, gs, True)
-    gs.makeMove(move)
+    move = bookMove(gs) or minmax.iterativeDeepening(gs, timeLimit=MINIMAX_TIME)
+    gs.makeMove(move, "minimax")
 
 def agentPlay(gs, agent):
-    state = gs.boardAsNumbers()
-    action = agent.select_action(state)
-    moves, movesID = gs.getValidMoves()
-    gs.makeMove(moves[action])
+    global searchTree
+    move = bookMove(gs)
+    if move is None:
+        if searchTree is None:
+            import inference
+            searchTree = mcts.MCTS(inference.net_evaluator(agent.policyNet, agent.device))
+        move = searchTree.best_move(gs, MCTS_PLAYOUTS)
+    gs.makeMove(move, "alpha")
 
 PLAYERS = {"human": humanPlay, "random": randomPlay, "minimax": minimaxPlay, "alpha": agentPlay}
 
@@ -0,0 +1,54 @@
+#!/bin/env python3
+
+import os
+import sys
+import json
+import subprocess
+
+''' Import time of the modules that must not need a display or a deep learning stack: each one is imported
+    in a fresh interpreter (as a forked worker or a new script would), the best of a few runs is compared with
+    its budget, and none of HEAVY_MODULES may have been imported with it. Exits with 1 on any failure. '''
+
+# seconds, numpy alone takes around 0.1
+BUDGETS = {"engine": 0.5, "bitboard": 0.5, "transposition": 0.2, "pst": 0.2, "minimax_abPrunning": 0.5,
+           "tablebase": 0.5, "book": 0.5, "actions": 0.5, "perft": 0.5, "parallel_search": 0.5,
+           "batch_env": 0.5, "mcts": 0.5, "dataset": 0.5, "inference": 0.5, "selfplay": 0.5, "arena": 0.5}
+HEAVY_MODULES = ["pygame", "torch", "torchvision", "game", "neural_reinforcement"]
+RUNS = 3
+
+MEASURE = '''
+import sys, time, json
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps([elapsed, [name for name in {heavy!r} if name in sys.modules]]))
+'''
+
+
+def measure(module, runs=RUNS):
+    ''' (best seconds, heavy modules it pulled in) '''
+    here = os.path.dirname(os.path.abspath(__file__))
+    best = None
+    heavy = []
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", MEASURE.format(module=module, heavy=HEAVY_MODULES)],
+                                cwd=here, capture_output=True, text=True, check=True).stdout
+        elapsed, heavy = json.loads(output.strip().splitlines()[-1])
+        best = elapsed if best is None else min(best, elapsed)
+    return best, heavy
+
+
+def main(modules=None):
+    failed = False
+    for module in modules or BUDGETS:
+        elapsed, heavy = measure(module)
+        ok = elapsed <= BUDGETS.get(module, 0.5) and not heavy
+        failed |= not ok
+        print("{:20} {:7.1f}ms  budget {:5.0f}ms  {}{}".format(module, elapsed * 1000, BUDGETS.get(module, 0.5) * 1000,
+                                                            "ok" if ok else "FAIL", " imports " + ", ".join(heavy) if heavy else ""))
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    # python import_time.py [module...]
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,204 @@
+#!/bin/env python3
+
+import sys
+import time
+import queue
+import random
+import threading
+from concurrent.futures import Future
+
+import numpy as np
+
+import actions
+
+''' Batched inference for many games at once: games (threads) submit a position and its legal action mask,
+    a worker thread gathers the requests and runs the network once per batch, when batch_size positions are
+    waiting or the oldest one has waited max_latency seconds, then hands every game its own row back. '''
+
+BATCH_SIZE = 64
+MAX_LATENCY = 0.002  # seconds the first request of a batch may wait for the batch to fill
+
+
+def net_evaluator(net, device="cpu"):
+    ''' Batch function for a ChessNet: (observations, masks) arrays in, (log_pi, values) arrays out '''
+    import torch
+    net.eval()
+
+    def evaluate(observations, masks):
+        with torch.no_grad():
+            log_pi, values = net(torch.from_numpy(observations).to(device), torch.from_numpy(masks).to(device))
+        return log_pi.cpu().numpy(), values.cpu().numpy()[:, 0]
+    return evaluate
+
+
+def numpy_evaluator(hidden=512, seed=0):
+    ''' Batch function of a numpy network shaped like ChessNet (random weights), for benchmarks without torch '''
+    rng = np.random.RandomState(seed)
+    layers = [(rng.randn(n_in, n_out).astype(np.float32) / np.sqrt(n_in), np.zeros(n_out, dtype=np.float32))
+              for n_in, n_out in ((64, hidden), (hidden, hidden), (hidden, actions.ACTION_SIZE + 1))]
+
+    def evaluate(observations, masks):
+        x = observations
+        for i, (weights, bias) in enumerate(layers):
+            x = x @ weights + bias
+            if i < len(layers) - 1:
+                x = np.maximum(x, 0)
+        pi = np.where(masks, x[:, :-1], -np.inf)
+        pi -= pi.max(axis=1, keepdims=True)
+        log_pi = pi - np.log(np.exp(pi).sum(axis=1, keepdims=True))
+        return log_pi, np.tanh(x[:, -1])
+    return evaluate
+
+
+class InferenceServer:
+    def __init__(self, evaluate, batch_size=BATCH_SIZE, max_latency=MAX_LATENCY):
+        self.evaluate_batch = evaluate
+        self.batch_size = batch_size
+        self.max_latency = max_latency
+        self.requests = queue.Queue()
+        self.observations = np.zeros((batch_size, 64), dtype=np.float32)  # reused for every batch
+        self.masks = np.zeros((batch_size, actions.ACTION_SIZE), dtype=bool)
+        self.thread = None
+        self.running = False
+        self.reset_stats()
+
+    def reset_stats(self):
+        self.batches = 0
+        self.positions = 0
+        self.full_batches = 0
+        self.waits = []  # seconds between submit and the start of the batch, per position
+        self.eval_time = 0.0
+
+    def start(self):
+        self.running = True
+        self.thread = threading.Thread(target=self.serve, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.running = False
+        self.requests.put(None)
+        self.thread.join()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+    def submit(self, observation, mask):
+        ''' Future of (log_pi, value) for one position '''
+        future = Future()
+        self.requests.put((observation, mask, future, time.perf_counter()))
+        return future
+
+    def evaluate(self, observation, mask):
+        return self.submit(observation, mask).result()
+
+    def serve(self):
+        while self.running:
+            first = self.requests.get()
+            if first is None:
+                break
+            batch = [first]
+            deadline = first[3] + self.max_latency
+            while len(batch) < self.batch_size:
+                timeout = deadline - time.perf_counter()
+                try:
+                    request = self.requests.get(timeout=timeout) if timeout > 0 else self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.running = False
+                    break
+                batch.append(request)
+            self.run_batch(batch)
+        # nobody is left to answer the ones still queued
+        while not self.requests.empty():
+            request = self.requests.get_nowait()
+            if request is not None:
+                request[2].set_exception(RuntimeError("inference server stopped"))
+
+    def run_batch(self, batch):
+        n = len(batch)
+        start = time.perf_counter()
+        for i, (observation, mask, future, submitted) in enumerate(batch):
+            self.observations[i] = observation
+            self.masks[i] = mask
+            self.waits.append(start - submitted)
+        try:
+            log_pi, values = self.evaluate_batch(self.observations[:n], self.masks[:n])
+        except Exception as e:
+            for request in batch:
+                request[2].set_exception(e)
+            return
+        self.eval_time += time.perf_counter() - start
+        self.batches += 1
+        self.positions += n
+        self.full_batches += n == self.batch_size
+        for i, request in enumerate(batch):
+            request[2].set_result((log_pi[i], values[i]))
+
+    def stats(self):
+        waits = np.array(self.waits) if self.waits else np.zeros(1)
+        return {"batches": self.batches, "positions": self.positions,
+                "fill": self.positions / (self.batches * self.batch_size) if self.batches else 0.0,
+                "full_batches": self.full_batches,
+                "wait_mean": float(waits.mean()), "wait_p50": float(np.percentile(waits, 50)),
+                "wait_p99": float(np.percentile(waits, 99)), "eval_time": self.eval_time}
+
+    def report(self):
+        s = self.stats()
+        print("{} positions in {} batches, batch fill {:.1%} ({} full), queue wait mean {:.2f}ms p50 {:.2f}ms p99 {:.2f}ms, "
+              "network {:.2f}s".format(s["positions"], s["batches"], s["fill"], s["full_batches"], s["wait_mean"] * 1000,
+                                       s["wait_p50"] * 1000, s["wait_p99"] * 1000, s["eval_time"]))
+
+
+def play_games(server, games, moves_per_game, backend="list"):
+    ''' Each thread plays a game where every move is the network's choice among the legal ones '''
+    import engine
+    from batch_env import board_codes
+
+    def play(seed):
+        rng = random.Random(seed)
+        gs = engine.newGameState(backend)
+        mask = np.zeros(actions.ACTION_SIZE, dtype=bool)
+        for _ in range(moves_per_game):
+            if gs.gameStatus() is not None:
+                gs = engine.newGameState(backend)
+            actions.legalMask(gs, mask)
+            log_pi, value = server.evaluate(np.array(board_codes(gs), dtype=np.float32), mask)
+            action = int(np.argmax(log_pi)) if rng.random() > 0.3 else rng.choice(np.flatnonzero(mask))
+            gs.playMove(actions.actionMove(gs, action))
+
+    threads = [threading.Thread(target=play, args=(i,)) for i in range(games)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+
+def benchmark(games=64, moves_per_game=20, batch_size=BATCH_SIZE, evaluator="net"):
+    ''' The same games with one position per forward call and with batches of up to batch_size.
+        evaluator: "net" for a ChessNet, "numpy" for numpy_evaluator '''
+    if evaluator == "net":
+        import neural_reinforcement as nr
+        evaluate = net_evaluator(nr.ChessNet(None, {}))
+    else:
+        evaluate = numpy_evaluator()
+    for size in (1, batch_size):
+        with InferenceServer(evaluate, batch_size=size) as server:
+            start = time.time()
+            play_games(server, games, moves_per_game)
+            elapsed = time.time() - start
+        print("batch size {}: {} games x {} moves in {:.2f}s, {:.0f} positions/s".format(
+            size, games, moves_per_game, elapsed, server.positions / elapsed))
+        server.report()
+
+
+if __name__ == "__main__":
+    # python inference.py [games] [moves per game] [batch size] [net|numpy]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else 64,
+              int(sys.argv[2]) if len(sys.argv) > 2 else 20,
+              int(sys.argv[3]) if len(sys.argv) > 3 else BATCH_SIZE,
+              sys.argv[4] if len(sys.argv) > 4 else "net")
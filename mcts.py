@@ -0,0 +1,244 @@
+#!/bin/env python3
+
+import sys
+import time
+
+import numpy as np
+
+import engine
+import actions
+from batch_env import board_codes
+
+''' Monte Carlo tree search guided by the policy and value of the network (PUCT, as in AlphaZero).
+    Nodes are rows of preallocated arrays, the children of a node are a contiguous block of rows, so a tree is
+    a handful of numpy arrays instead of one Python object per node. Leaves are selected leaf_batch at a time,
+    virtual loss keeps the selections of one batch apart, and they go to the network as one batch.
+    The subtree of the moves played since the last search is kept and becomes the new tree. '''
+
+MAX_NODES = 500000
+C_PUCT = 1.5
+LEAF_BATCH = 16
+VIRTUAL_LOSS = 1
+PLAYOUTS = 800
+
+UNEXPANDED = 0
+EXPANDED = 1
+TERMINAL = 2
+
+
+def uniform_evaluate(observations, masks):
+    ''' Same signature as inference.net_evaluator's function: every legal move equally likely, value 0 '''
+    with np.errstate(divide="ignore"):
+        log_pi = np.log(masks / masks.sum(axis=1, keepdims=True))
+    return log_pi, np.zeros(len(observations), dtype=np.float32)
+
+
+class MCTS:
+    def __init__(self, evaluate, max_nodes=MAX_NODES, c_puct=C_PUCT, leaf_batch=LEAF_BATCH, virtual_loss=VIRTUAL_LOSS):
+        self.evaluate = evaluate  # (observations, masks) -> (log_pi, values), values for the side to move
+        self.max_nodes = max_nodes
+        self.c_puct = c_puct
+        self.leaf_batch = leaf_batch
+        self.virtual_loss = virtual_loss
+
+        self.parent = np.zeros(max_nodes, dtype=np.int32)
+        self.action = np.zeros(max_nodes, dtype=np.int32)  # action (actions.py) leading to the node
+        self.move_code = np.zeros(max_nodes, dtype=np.int32)  # and the same move as Move.code
+        self.first_child = np.zeros(max_nodes, dtype=np.int32)
+        self.num_children = np.zeros(max_nodes, dtype=np.int32)
+        self.state = np.zeros(max_nodes, dtype=np.int8)
+        self.prior = np.zeros(max_nodes, dtype=np.float32)
+        self.visits = np.zeros(max_nodes, dtype=np.int32)
+        self.value_sum = np.zeros(max_nodes, dtype=np.float32)  # for the player who made the move to the node
+        self.virtual = np.zeros(max_nodes, dtype=np.int32)  # pending selections through the node
+        self.terminal_value = np.zeros(max_nodes, dtype=np.float32)  # for the side to move, TERMINAL nodes only
+
+        self.playouts = 0
+        self.search_time = 0.0
+        self.reused = 0  # visits the root already had when the last search started
+        self.reset()
+
+    def reset(self):
+        self.root = 0
+        self.count = 1
+        self.clear(0, 1)
+        self.parent[0] = -1
+        self.root_key = None
+        self.root_ply = 0
+
+    def clear(self, start, end):
+        for array in (self.state, self.visits, self.value_sum, self.virtual, self.num_children):
+            array[start:end] = 0
+
+    def sync(self, gs):
+        ''' Makes the root the node of gs's position, keeping what was searched below it when possible '''
+        ply = len(gs.moveLog)
+        keys = gs.hashLog + [gs.hashKey]
+        if self.root_key is None or ply < self.root_ply or len(keys) <= self.root_ply or keys[self.root_ply] != self.root_key:
+            self.reset()
+        else:
+            node = self.root
+            for move in gs.moveLog[self.root_ply:]:
+                node = self.child(node, actions.moveAction(move))
+                if node < 0:
+                    break
+            if node < 0:
+                self.reset()
+            else:
+                self.root = node
+                if self.count > self.max_nodes // 2:
+                    self.compact()
+        self.root_key = gs.hashKey
+        self.root_ply = ply
+
+    def child(self, node, action):
+        if self.state[node] != EXPANDED:
+            return -1
+        first = self.first_child[node]
+        found = np.flatnonzero(self.action[first:first + self.num_children[node]] == action)
+        return first + found[0] if len(found) else -1
+
+    def compact(self):
+        ''' Moves the root's subtree to the front of the arrays, dropping the rest of the old tree '''
+        fields = (self.action, self.move_code, self.state, self.prior, self.visits, self.value_sum, self.terminal_value)
+        old = [array[:self.count].copy() for array in fields]
+        old_first = self.first_child[:self.count].copy()
+        old_children = self.num_children[:self.count].copy()
+        for array, values in zip(fields, old):
+            array[0] = values[self.root]
+        self.parent[0] = -1
+        queue = [(self.root, 0)]
+        free = 1
+        for old_node, node in queue:
+            k = old_children[old_node] if old[2][old_node] == EXPANDED else 0
+            self.num_children[node] = k
+            if not k:
+                continue
+            first = old_first[old_node]
+            for array, values in zip(fields, old):
+                array[free:free + k] = values[first:first + k]
+            self.parent[free:free + k] = node
+            self.first_child[node] = free
+            queue.extend(zip(range(first, first + k), range(free, free + k)))
+            free += k
+        self.virtual[:free] = 0
+        self.root = 0
+        self.count = free
+
+    def select(self, gs):
+        ''' Walks from the root to a leaf, playing the moves on gs and adding virtual loss on the way '''
+        node = self.root
+        path = [node]
+        while self.state[node] == EXPANDED:
+            first = self.first_child[node]
+            children = slice(first, first + self.num_children[node])
+            visits = self.visits[children] + self.virtual[children]
+            q = np.where(visits > 0, (self.value_sum[children] - self.virtual[children]) / np.maximum(visits, 1), 0.0)
+            parent_visits = self.visits[node] + self.virtual[node]
+            u = self.c_puct * self.prior[children] * np.sqrt(max(parent_visits, 1)) / (1 + visits)
+            node = first + int(np.argmax(q + u))
+            self.virtual[node] += self.virtual_loss
+            gs.movePiece(engine.Move.fromCode(int(self.move_code[node]), gs.board))
+            path.append(node)
+        return node, path
+
+    def expand(self, node, legal, log_pi):
+        n = len(legal)
+        if self.count + n > self.max_nodes:
+            return  # full: the leaf stays a leaf until the next compact
+        block = slice(self.count, self.count + n)
+        action_list = np.fromiter(legal, dtype=np.int32, count=n)
+        priors = np.exp(log_pi[action_list] - log_pi[action_list].max())
+        self.clear(self.count, self.count + n)
+        self.parent[block] = node
+        self.action[block] = action_list
+        self.move_code[block] = [move.code for move in legal.values()]
+        self.prior[block] = priors / priors.sum()
+        self.first_child[node] = self.count
+        self.num_children[node] = n
+        self.state[node] = EXPANDED
+        self.count += n
+
+    def backup(self, path, value):
+        ''' value is for the side to move at the leaf, each node above gets it from its own mover's side '''
+        nodes = np.array(path[::-1])
+        signs = np.where(np.arange(len(nodes)) % 2 == 0, -1.0, 1.0)
+        self.value_sum[nodes] += signs * value
+        self.visits[nodes] += 1
+        self.virtual[nodes[:-1]] -= self.virtual_loss  # the root never gets virtual loss
+
+    def search(self, gs, playouts=PLAYOUTS):
+        ''' Runs playouts from gs's position (gs is left as it was), returns the root's {action: visits} '''
+        self.sync(gs)
+        self.reused = int(self.visits[self.root])
+        start = time.perf_counter()
+        start_ply = len(gs.moveLog)
+        done = 0
+        while done < playouts:
+            pending = []  # (node, path, legal) waiting for the network
+            observations = []
+            masks = []
+            for _ in range(min(self.leaf_batch, playouts - done)):
+                node, path = self.select(gs)
+                done += 1
+                if self.state[node] == UNEXPANDED:
+                    status = gs.gameStatus()
+                    if status is not None:
+                        self.state[node] = TERMINAL
+                        self.terminal_value[node] = -1.0 if status == engine.CHECKMATE else 0.0
+                if self.state[node] == TERMINAL:
+                    self.backup(path, self.terminal_value[node])
+                elif any(node == p[0] for p in pending):
+                    self.virtual[path[1:]] -= self.virtual_loss  # the same leaf twice in one batch, dropped
+                else:
+                    legal = actions.legalActions(gs)
+                    pending.append((node, path, legal))
+                    observations.append(board_codes(gs))
+                    mask = np.zeros(actions.ACTION_SIZE, dtype=bool)
+                    mask[list(legal)] = True
+                    masks.append(mask)
+                gs.unwindTo(start_ply)
+            if pending:
+                log_pi, values = self.evaluate(np.array(observations, dtype=np.float32), np.array(masks))
+                for i, (node, path, legal) in enumerate(pending):
+                    self.expand(node, legal, log_pi[i])
+                    self.backup(path, float(values[i]))
+        self.playouts += done
+        self.search_time += time.perf_counter() - start
+        first = self.first_child[self.root]
+        children = range(first, first + self.num_children[self.root]) if self.state[self.root] == EXPANDED else []
+        return {int(self.action[c]): int(self.visits[c]) for c in children}
+
+    def best_move(self, gs, playouts=PLAYOUTS):
+        ''' The legal Move of gs searched the most '''
+        counts = self.search(gs, playouts)
+        return actions.actionMove(gs, max(counts, key=counts.get))
+
+    def playouts_per_second(self):
+        return self.playouts / self.search_time if self.search_time else 0.0
+
+
+def benchmark(playouts=PLAYOUTS, moves=10, evaluator="uniform", backend="list"):
+    ''' Self-play with one tree kept between the moves, prints playouts/s and how much of each tree was reused '''
+    if evaluator == "net":
+        import inference
+        import neural_reinforcement as nr
+        evaluate = inference.net_evaluator(nr.ChessNet(None, {}))
+    else:
+        evaluate = uniform_evaluate
+    tree = MCTS(evaluate)
+    gs = engine.newGameState(backend)
+    for _ in range(moves):
+        if gs.gameStatus() is not None:
+            break
+        move = tree.best_move(gs, playouts)
+        print("{}: {} visits reused, {} nodes, {:.0f} playouts/s".format(
+            engine.packedMove(move.code).uci, tree.reused, tree.count, tree.playouts_per_second()))
+        gs.playMove(move)
+
+
+if __name__ == "__main__":
+    # python mcts.py [playouts] [moves] [uniform|net]
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else PLAYOUTS,
+              int(sys.argv[2]) if len(sys.argv) > 2 else 10,
+              sys.argv[3] if len(sys.argv) > 3 else "uniform")
@@ -1,45 +1,341 @@
+import sys
 import engine
 import random
+import time
+import transposition as tp
+import tablebase
+import pst
 
-def minimaxRoot(depth, gs, isMaximizing):
-    moves, movesID = gs.getValidMoves()
-    bestMove = -9999
+TT_SIZE_MB = 16
+MAX_PLY = 64
+EVAL_NOISE = False  # opt-in random noise on evaluation, scores can't be cached or reproduced with it
+EVAL_CHECK = False  # compare the incremental evaluation with a full recompute at every leaf (testing)
+QUIESCENCE = True  # keep searching captures and promotions at depth 0, off gives the plain evaluation
+USE_PVS = True  # minimaxRoot searches with negamax (PVS, null move, LMR), off uses the plain minimax below
+NULL_MOVE_MIN_DEPTH = 3
+NULL_MOVE_REDUCTION = 2
+LMR_MIN_DEPTH = 3
+LMR_FULL_MOVES = 3  # moves searched at full depth before the quiet ones start being reduced
+LMR_LATE_MOVES = 10  # reduced by one more ply from here on
+TABLEBASES = True  # positions of the endgame tables (tablebase.py) are scored from them, not searched
+VERBOSE = False  # print every better root move, every finished depth and the table stats
+transpositionTable = tp.TranspositionTable(TT_SIZE_MB)
+
+
+class SearchTimeout(Exception):
+    pass
+
+
+class SearchInfo():
+    ''' State shared by every node of one search: budgets, node count and the move ordering heuristics '''
+    def __init__(self, timeLimit=None, nodeLimit=None):
+        self.deadline = time.time() + timeLimit if timeLimit is not None else None
+        self.nodeLimit = nodeLimit
+        self.nodes = 0
+        self.depth = 0  # last depth searched completely
+        self.bestScore = None  # root score of that depth
+        self.killers = [[0, 0] for _ in range(MAX_PLY)]  # two quiet moves per ply that caused a cutoff
+        self.history = [0] * 4096  # from-to square -> how often (weighted by depth) the quiet move cut
+
+    def countNode(self):
+        self.nodes += 1
+        if self.nodeLimit is not None and self.nodes > self.nodeLimit:
+            raise SearchTimeout()
+        if self.deadline is not None and self.nodes & 1023 == 0 and time.time() > self.deadline:
+            raise SearchTimeout()
+
+    def storeCutoff(self, move, depth, ply):
+        if move.pieceCaptured != "--" or move.isEnPassantMove or move.isPromotionMove:
+            return
+        code = move.code
+        killers = self.killers[min(ply, MAX_PLY - 1)]
+        if killers[0] != code:
+            killers[1] = killers[0]
+            killers[0] = code
+        self.history[code & 0xFFF] += depth * depth
+
+
+def iterativeDeepening(gs, timeLimit=None, nodeLimit=None, maxDepth=MAX_PLY, tt=None, info=None):
+    ''' Searches depth 1, 2, 3... until the time (seconds) or node budget runs out and returns the
+        best move of the last depth that was searched completely. info: SearchInfo to search with, for the
+        caller to read the depth reached, score and nodes from afterwards '''
+    tt = transpositionTable if tt is None else tt
+    tt.newSearch()
+    info = SearchInfo(timeLimit, nodeLimit) if info is None else info
+    startPly = len(gs.moveLog)
+    bestMove = None
+    for depth in range(1, maxDepth + 1):
+        try:
+            move = minimaxRoot(depth, gs, True, tt, info, bestMove)
+        except SearchTimeout:
+            gs.unwindTo(startPly)  # the search was stopped in the middle of a line
+            break
+        if move is None:  # no legal moves
+            break
+        bestMove = move
+        info.depth = depth
+        if VERBOSE:
+            print("Depth {}: best move {}, {} nodes".format(depth, bestMove.moveID, info.nodes))
+    if bestMove is None:
+        moves = gs.legalMoves()
+        bestMove = moves[0] if moves else None
+    return bestMove
+
+
+def minimaxRoot(depth, gs, isMaximizing, tt=None, info=None, firstMove=None):
+    tt = transpositionTable if tt is None else tt
+    if info is None:
+        tt.newSearch()
+        info = SearchInfo()
+    moves = gs.legalMoves()
+    orderMoves(moves, tt.probe(gs.hashKey), info, 0)
+    if firstMove is not None:  # best move of the previous iteration
+        for i in range(len(moves)):
+            if moves[i].code == firstMove.code:
+                moves.insert(0, moves.pop(i))
+                break
+    bestMove = -tp.MATE
     bestMoveFinal = None
     for move in moves:
         gs.movePiece(move)
-        value = max(bestMove, minimax(depth - 1, gs, -10000, 10000, not isMaximizing))
+        # a worse move can only come back <= alpha, so the best move and its score don't change
+        alpha = -10000 if bestMoveFinal is None else bestMove
+        if not USE_PVS:
+            value = max(bestMove, minimax(depth - 1, gs, alpha, 10000, not isMaximizing, tt, info, 1))
+        elif bestMoveFinal is None:
+            value = -negamax(depth - 1, gs, -10000, 10000, tt, info, 1)
+        else:  # null window first: only a move better than the best one needs its exact score
+            value = -negamax(depth - 1, gs, -alpha - 1, -alpha, tt, info, 1)
+            if value > alpha:
+                value = -negamax(depth - 1, gs, -10000, -alpha, tt, info, 1)
         gs.undoMove()
         if( value > bestMove):
-            print("Best score: ", str(bestMove))
+            if VERBOSE:
+                print("Best score: ", str(bestMove))
             bestMove = value
             bestMoveFinal = move
+    tt.store(gs.hashKey, depth, bestMove, tp.EXACT, tp.packMove(bestMoveFinal))
+    info.bestScore = bestMove
+    if VERBOSE:
+        print("TT hit rate: {:.1%} ({} probes), usage: {:.1%}".format(tt.hitRate(), tt.probes, tt.usage()))
     return bestMoveFinal
 
 
-def minimax(depth, gs, alpha, beta, is_maximizing):
-    moves, movesID = gs.getValidMoves()
+def orderMoves(moves, entry, info=None, ply=0):
+    # table move, captures (most valuable victim, least valuable attacker), promotions, killers, history
+    ttCode = entry[3] if entry is not None else 0
+    killers = info.killers[min(ply, MAX_PLY - 1)] if info is not None else (0, 0)
+    history = info.history if info is not None else None
+
+    def moveScore(move):
+        code = move.code
+        if ttCode and code == ttCode:
+            return 1000000
+        if move.pieceCaptured != "--" or move.isEnPassantMove:
+            victim = "p" if move.isEnPassantMove else move.pieceCaptured[1]
+            return 100000 + pst.PIECE_VALUES[victim] * 10 - pst.PIECE_VALUES[move.pieceMoved[1]]
+        if move.isPromotionMove:
+            return 90000 + pst.PIECE_VALUES[move.piecePromoted[1]]
+        if code == killers[0]:
+            return 80001
+        if code == killers[1]:
+            return 80000
+        return history[code & 0xFFF] if history is not None else 0
+
+    moves.sort(key=moveScore, reverse=True)
+
+
+def minimax(depth, gs, alpha, beta, is_maximizing, tt=None, info=None, ply=0):
+    # scores are from the point of view of the root player (the maximizing one),
+    # the table keeps them from the side to move's point of view so they can be shared between searches
+    if info is None:
+        info = SearchInfo()
+    info.countNode()
+    if TABLEBASES and ply > 0:
+        score = tablebase.probeScore(gs)
+        if score is not None:
+            return score if is_maximizing else -score
     if(depth == 0):
-        return -evaluation(gs)
+        if not QUIESCENCE:
+            return evaluation(gs) if is_maximizing else -evaluation(gs)
+        return quiescence(gs, alpha, beta, info, ply) if is_maximizing else -quiescence(gs, -beta, -alpha, info, ply)
+    tt = transpositionTable if tt is None else tt
+    entry = tt.probe(gs.hashKey, ply)
+    if entry is not None and tt.usable(entry[0], depth):
+        ttDepth, score, bound, moveCode = entry
+        if not is_maximizing:
+            score = -score
+            bound = {tp.LOWER: tp.UPPER, tp.UPPER: tp.LOWER}.get(bound, bound)
+        if bound == tp.EXACT or (bound == tp.LOWER and score >= beta) or (bound == tp.UPPER and score <= alpha):
+            return score
+    moves = gs.legalMoves()
+    if not moves:  # checkmate or stalemate, nothing to search
+        score = -(tp.MATE - ply) if gs.inCheck() else 0  # a nearer mate is a better one
+        return score if is_maximizing else -score
+    orderMoves(moves, entry, info, ply)
+    alphaOrig, betaOrig = alpha, beta
+    bestMoveFinal = None
     if(is_maximizing):
-        bestMove = -9999
+        bestMove = -tp.MATE
         for move in moves:
             gs.movePiece(move)
-            bestMove = max(bestMove,minimax(depth - 1, gs, alpha, beta, not is_maximizing))
+            value = minimax(depth - 1, gs, alpha, beta, not is_maximizing, tt, info, ply + 1)
             gs.undoMove()
+            if value > bestMove:
+                bestMove = value
+                bestMoveFinal = move
             alpha = max(alpha, bestMove)
             if beta <= alpha:
-                return bestMove
-        return bestMove
+                info.storeCutoff(move, depth, ply)
+                break
     else:
-        bestMove = 9999
+        bestMove = tp.MATE
         for move in moves:
             gs.movePiece(move)
-            bestMove = min(bestMove, minimax(depth - 1, gs, alpha, beta, not is_maximizing))
+            value = minimax(depth - 1, gs, alpha, beta, not is_maximizing, tt, info, ply + 1)
             gs.undoMove()
+            if value < bestMove:
+                bestMove = value
+                bestMoveFinal = move
             beta = min(beta, bestMove)
             if(beta <= alpha):
-                return bestMove
-        return bestMove
+                info.storeCutoff(move, depth, ply)
+                break
+    if bestMove <= alphaOrig:
+        bound = tp.UPPER
+    elif bestMove >= betaOrig:
+        bound = tp.LOWER
+    else:
+        bound = tp.EXACT
+    if not is_maximizing:
+        bound = {tp.LOWER: tp.UPPER, tp.UPPER: tp.LOWER}.get(bound, bound)
+    tt.store(gs.hashKey, depth, bestMove if is_maximizing else -bestMove, bound, tp.packMove(bestMoveFinal), ply)
+    return bestMove
+
+def negamax(depth, gs, alpha, beta, tt=None, info=None, ply=0, nullAllowed=True):
+    ''' Principal variation search, scores are from the side to move's point of view. The first move gets the
+        full window, the others a null window and are searched again only if they beat alpha '''
+    if info is None:
+        info = SearchInfo()
+    info.countNode()
+    if TABLEBASES and ply > 0:
+        score = tablebase.probeScore(gs)
+        if score is not None:
+            return score
+    if depth <= 0:
+        return quiescence(gs, alpha, beta, info, ply) if QUIESCENCE else evaluation(gs)
+    tt = transpositionTable if tt is None else tt
+    entry = tt.probe(gs.hashKey, ply)
+    if entry is not None and tt.usable(entry[0], depth):
+        ttDepth, score, bound, moveCode = entry
+        if bound == tp.EXACT or (bound == tp.LOWER and score >= beta) or (bound == tp.UPPER and score <= alpha):
+            return score
+    inCheck = gs.kingInCheck()
+    # null move: if passing still fails high the position is good enough to stop here,
+    # not in check and not with only king and pawns where passing may be better than any move (zugzwang)
+    if nullAllowed and not inCheck and depth >= NULL_MOVE_MIN_DEPTH and abs(beta) < 9000 \
+            and gs.hasNonPawnMaterial() and evaluation(gs) >= beta:
+        gs.makeNullMove()
+        value = -negamax(depth - 1 - NULL_MOVE_REDUCTION, gs, -beta, -beta + 1, tt, info, ply + 1, False)
+        gs.undoNullMove()
+        if value >= beta:
+            return value
+    moves = gs.legalMoves()
+    if not moves:
+        return -(tp.MATE - ply) if inCheck else 0
+    orderMoves(moves, entry, info, ply)
+    killers = info.killers[min(ply, MAX_PLY - 1)]
+    alphaOrig = alpha
+    bestMove = -10000
+    bestMoveFinal = None
+    for i, move in enumerate(moves):
+        gs.movePiece(move)
+        if i == 0:
+            value = -negamax(depth - 1, gs, -beta, -alpha, tt, info, ply + 1)
+        else:
+            reduction = 0
+            # late quiet moves rarely matter, they get a shallower search unless it comes back above alpha
+            if depth >= LMR_MIN_DEPTH and i >= LMR_FULL_MOVES and not inCheck and not move.isCapture() \
+                    and not move.isPromotionMove and move.code not in killers and not gs.kingInCheck():
+                reduction = 2 if i >= LMR_LATE_MOVES and depth > 3 else 1
+            value = -negamax(depth - 1 - reduction, gs, -alpha - 1, -alpha, tt, info, ply + 1)
+            if value > alpha and reduction:
+                value = -negamax(depth - 1, gs, -alpha - 1, -alpha, tt, info, ply + 1)
+            if alpha < value < beta:
+                value = -negamax(depth - 1, gs, -beta, -alpha, tt, info, ply + 1)
+        gs.undoMove()
+        if value > bestMove:
+            bestMove = value
+            bestMoveFinal = move
+        alpha = max(alpha, bestMove)
+        if alpha >= beta:
+            info.storeCutoff(move, depth, ply)
+            break
+    if bestMove <= alphaOrig:
+        bound = tp.UPPER
+    elif bestMove >= beta:
+        bound = tp.LOWER
+    else:
+        bound = tp.EXACT
+    tt.store(gs.hashKey, depth, bestMove, bound, tp.packMove(bestMoveFinal), ply)
+    return bestMove
+
+
+def compareSearches(gs, maxDepth=5):
+    ''' Nodes per depth of the plain minimax and of negamax PVS from the same position, each with an empty table.
+        The effective branching factor is nodes(depth) / nodes(depth - 1) '''
+    global USE_PVS
+    usePvs = USE_PVS
+    results = {}
+    try:
+        for pvs in (False, True):
+            USE_PVS = pvs
+            nodes = []
+            for depth in range(1, maxDepth + 1):
+                info = SearchInfo()
+                start = time.time()
+                move = minimaxRoot(depth, gs, True, tp.TranspositionTable(TT_SIZE_MB), info)
+                ebf = info.nodes / nodes[-1] if nodes else float(info.nodes)
+                nodes.append(info.nodes)
+                print("{} depth {}: {} nodes, EBF {:.2f}, {:.2f}s, best move {}".format(
+                    "pvs    " if pvs else "minimax", depth, info.nodes, ebf, time.time() - start, move.moveID if move else None))
+            results["pvs" if pvs else "minimax"] = nodes
+    finally:
+        USE_PVS = usePvs
+    return results
+
+
+def quiescence(gs, alpha, beta, info=None, ply=0):
+    ''' Search of captures and promotions only, past the horizon of minimax. Scores are from the side to move's
+        point of view: it can stand pat on the evaluation unless in check, then every evasion is tried '''
+    if info is None:
+        info = SearchInfo()
+    info.countNode()
+    if TABLEBASES:
+        score = tablebase.probeScore(gs)
+        if score is not None:
+            return score
+    if gs.kingInCheck():  # not the cached inCheck, that one generates every legal move
+        bestMove = -(tp.MATE - ply)  # checkmate unless an evasion is found
+        moves = gs.legalMoves()
+    else:
+        bestMove = evaluation(gs)
+        if bestMove >= beta or ply >= MAX_PLY - 1:
+            return bestMove
+        alpha = max(alpha, bestMove)
+        # captures that lose material when every recapture is counted are not worth playing
+        moves = [move for move in gs.legalCaptures() if gs.staticExchange(move) >= 0]
+    orderMoves(moves, None)
+    for move in moves:
+        gs.movePiece(move)
+        value = -quiescence(gs, -beta, -alpha, info, ply + 1)
+        gs.undoMove()
+        if value > bestMove:
+            bestMove = value
+        alpha = max(alpha, bestMove)
+        if alpha >= beta:
+            break
+    return bestMove
 
 '''
 def calculateMove(board):
@@ -62,34 +358,20 @@ def calculateMove(board):
     return bestMove
 '''
 
-def evaluation(gs):
-    board = gs.boardCopy()
-    evaluation = 0
-    imWhite = gs.whiteToMove
-    color = "w" if imWhite else "b"
-    for i in range(0, len(board)):
-        evaluation = evaluation + getPieceValue(board[i][1]) if board[i][0] == color else evaluation - getPieceValue(board[i][1])
-    evaluation = evaluation + random.uniform(0, 1)
-    #print(evaluation)
-    # Need more heuristics so maybe all moves have same value and do first one repeating
-    # it if there is no move that wins material
+def evaluation(gs, noise=None):
+    # material + piece-square tables kept up to date by GameState.movePiece/undoMove, from the side to move's view
+    if EVAL_CHECK:
+        assert gs.evalScore == gs.computeEvaluation(), "incremental evaluation out of sync"
+    evaluation = gs.evalScore if gs.whiteToMove else -gs.evalScore
+    if noise is None:
+        noise = EVAL_NOISE
+    if noise:
+        evaluation = evaluation + random.uniform(0, 10)
     return evaluation
 
 
-def getPieceValue(piece):
-    if piece == "-":
-        return 0
-    value = 0
-    if piece == "P" or piece == "p":
-        value = 10
-    if piece == "N" or piece == "n":
-        value = 30
-    if piece == "B" or piece == "b":
-        value = 30
-    if piece == "R" or piece == "r":
-        value = 50
-    if piece == "Q" or piece == "q":
-        value = 90
-    if piece == 'K' or piece == 'k':
-        value = 900
-    return value
+if __name__ == "__main__":
+    # python minimax_abPrunning.py [maxDepth] [FEN]
+    maxDepth = int(sys.argv[1]) if len(sys.argv) > 1 else 5
+    gs = engine.GameState.fromFEN(sys.argv[2]) if len(sys.argv) > 2 else engine.GameState()
+    compareSearches(gs, maxDepth)
@@ -1,5 +1,6 @@
 #!/bin/env python3
 import os
+import time
 
 import numpy as np
 import torch
@@ -7,7 +8,9 @@ from torch import nn
 import random
 
 import engine
+import actions
 import neural_reinforcement as nr
+import selfplay
 
 args = {
     'lr': 0.001,
@@ -16,6 +19,7 @@ args = {
     'batch_size': 64,
     'cuda': torch.cuda.is_available(),
     'num_channels': 512,
+    'dataset': None,  # directory to keep the experience in (dataset.py), training resumes from it
 }
 
 def fill_memory(env, agent, memory_fill_eps):
@@ -25,8 +29,7 @@ def fill_memory(env, agent, memory_fill_eps):
         while not done:
             #White (the agent)
             action = agent.select_action(state)
-            moves, movesID = env.getValidMoves()
-            env.makeMove(moves[action])
+            env.makeMove(actions.actionMove(env, action), "alpha")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             agent.replay_memory.store(state, action, next_state, done)
@@ -36,7 +39,7 @@ def fill_memory(env, agent, memory_fill_eps):
             #Black random
             moves, movesID = env.getValidMoves()
             move = moves[random.randint(0, len(moves) - 1)]
-            env.makeMove(move)
+            env.makeMove(move, "random")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             agent.replay_memory.store(state, action, next_state, done)
@@ -68,8 +71,7 @@ def train(env, agent, train_eps, memory_fill_eps, batchsize, update_freq, model_
         while not done:
             # White (the agent)
             action = agent.select_action(state)
-            moves, movesID = env.getValidMoves()
-            env.makeMove(moves[action])
+            env.makeMove(actions.actionMove(env, action), "alpha")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             agent.replay_memory.store(state, action, next_state, done)
@@ -80,7 +82,7 @@ def train(env, agent, train_eps, memory_fill_eps, batchsize, update_freq, model_
             # Black random
             moves, movesID = env.getValidMoves()
             move = moves[random.randint(0, len(moves) - 1)]
-            env.makeMove(move)
+            env.makeMove(move, "random")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             agent.replay_memory.store(state, action, next_state, done)
@@ -118,8 +120,7 @@ def test(env, agent, test_eps):
         while not done:
             # White (the agent)
             action = agent.select_action(state)
-            moves, movesID = env.getValidMoves()
-            env.makeMove(moves[action])
+            env.makeMove(actions.actionMove(env, action), "alpha")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             state = next_state
@@ -128,7 +129,7 @@ def test(env, agent, test_eps):
             # Black random
             moves, movesID = env.getValidMoves()
             move = moves[random.randint(0, len(moves) - 1)]
-            env.makeMove(move)
+            env.makeMove(move, "random")
             next_state = env.boardAsNumbers()
             done = env.inCheckMate() or env.itsDraw()
             state = next_state
@@ -145,13 +146,43 @@ def test(env, agent, test_eps):
         print('Ep: {}, Ep Score: {}'.format(ep_cnt, ep_reward))
 
 
+def make_policy_net():
+    # called in every actor process, their weights then come from the learner through selfplay.SharedWeights
+    return nr.ChessNet(engine.GameState(), args)
+
+def train_parallel(agent, train_steps, batchsize, update_freq, model_filename, num_actors=None, capacity=1000000):
+    # self-play runs in actor processes writing to a shared replay buffer, this process only learns
+    buffer = selfplay.SharedReplayBuffer(capacity, max_ahead=capacity // 2)
+    weights = selfplay.SharedWeights(agent.policyNet)
+    agent.replay_memory = buffer
+    policy = selfplay.NetPolicy(make_policy_net, weights, epsilon=agent.epsilon)
+    try:
+        with selfplay.ActorPool(buffer, num_actors, policy) as pool:
+            while len(buffer) < batchsize:
+                time.sleep(0.1)
+            for step_cnt in range(1, train_steps + 1):
+                agent.learn(batchsize)
+                if step_cnt % update_freq == 0:
+                    agent.update_target()
+                    weights.publish(agent.policyNet)
+                    print('Step: {}, Games: {}, Games/s: {:.2f}, Samples in memory: {}'.format(
+                        step_cnt, pool.games.value, pool.games_per_second(), len(buffer)))
+        agent.save(model_filename)
+    finally:
+        weights.close()
+        buffer.close()
+
 def main():
     train_mode = True
-    env = engine.GameState()
+    num_actors = 0  # > 0: self-play in that many processes with train_parallel
+    env = engine.newGameState("bitboard")
     model_filename = "AlphaZero"
     loss = nn.MSELoss()
     if train_mode:
         agent = nr.NetContext(env, args, 0.99, 0.01, 1.0, 0.95, 1000000, loss)
+        if num_actors:
+            train_parallel(agent, train_steps=100000, batchsize=64, update_freq=100, model_filename=model_filename, num_actors=num_actors)
+            return
         train(env=env, agent=agent, train_eps=200, memory_fill_eps=20, batchsize=64, update_freq=100, model_filename=model_filename)
     else:
         agent = nr.NetContext(env, args, 0.99, 0.0, 0.0, 0.0, 1000000, loss)
@@ -3,14 +3,14 @@
 import sys
 from collections import namedtuple, deque
 import random
-from utils import *
 import argparse
 import numpy as np
+import dataset
+import actions
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
 import torch.optim as optim
-from torchvision import datasets, transforms
 from torch.autograd import Variable
 
 
@@ -19,102 +19,126 @@ DRAW_VALUE = 0.8
 LOSS_VALUE = 0.0
 
 INPUT_SIZE = 2  # board and moves
+WIN_REWARD = 1000.0  # returns go from 0 (lost) to WIN_REWARD, the value head learns them as -1 .. 1 (a draw, 500, is 0)
 OUTPUT_SIZE = 1  # dict (moves: q_value)
 
 
 #DQN Memory
 class ReplayMemory:
-    def __init__(self, capacity):
+    # ring buffer of preallocated arrays, boards are kept as int8 (piece codes -6..6)
+    def __init__(self, capacity, pin_memory=False, writer=None):
         self.capacity = capacity
-        self.states = []
-        self.actions = []
-        self.next_states = []
-        self.rewards = [0 for _ in range(capacity)]
-        self.dones = []
+        self.pin_memory = pin_memory
+        self.writer = writer  # dataset.DatasetWriter getting every finished episode, if any
+        self.states = np.zeros((capacity, 64), dtype=np.int8)
+        self.actions = np.zeros(capacity, dtype=np.int64)
+        self.next_states = np.zeros((capacity, 64), dtype=np.int8)
+        self.rewards = np.zeros(capacity, dtype=np.float32)
+        self.dones = np.zeros(capacity, dtype=np.bool_)
         self.idx = 0
+        self.size = 0
+        self.episode_length = 0  # transitions stored since the last store_rewards
+        self.batches = None  # two sets of staging tensors, sample fills them in turn
+        self.copies = [None, None]  # CUDA event of the last copy out of each set
+        self.turn = 0
 
     def store(self, states, actions, next_states, dones):
-        if len(self.states) < self.capacity:
-            self.states.append(states)
-            self.actions.append(actions)
-            self.next_states.append(next_states)
-            #self.rewards.append(rewards)
-            self.dones.append(dones)
-        else:
-            self.states[self.idx] = states
-            self.actions[self.idx] = actions
-            self.next_states[self.idx] = next_states
-            #self.rewards[self.idx] = rewards
-            self.dones[self.idx] = dones
-
+        self.states[self.idx] = states
+        self.actions[self.idx] = actions
+        self.next_states[self.idx] = next_states
+        self.rewards[self.idx] = 0
+        self.dones[self.idx] = dones
         self.idx = (self.idx + 1) % self.capacity
+        self.size = min(self.size + 1, self.capacity)
+        self.episode_length = min(self.episode_length + 1, self.capacity)
 
     def store_rewards(self, reward, discount):
-        idx = self.idx
-        print(reward)
-        print(idx)
-        self.rewards[idx] = reward
-        next_idx = (idx - 1) % self.capacity
-        black = True
-        for _ in range(len(self.states)):
-            if not black:
-                self.rewards[next_idx] = self.rewards[idx] * discount
-            else:
-                self.rewards[next_idx] = 0
-            black = not black
-            idx = next_idx
-            next_idx = (idx - 1) % self.capacity
+        # only the episode that just ended: its last transition gets the reward, discounted back over every
+        # second transition before it (the same player's moves), the other player's ones stay at 0
+        n = self.episode_length
+        last = (self.idx - 1) % self.capacity
+        same_player = (last - np.arange(0, n, 2)) % self.capacity
+        self.rewards[same_player] = reward * discount ** np.arange(len(same_player), dtype=np.float32)
+        if self.writer is not None:
+            episode = (last - np.arange(n)[::-1]) % self.capacity
+            self.writer.append(self.states[episode], self.actions[episode], self.next_states[episode],
+                               self.rewards[episode], self.dones[episode])
+        self.episode_length = 0
+
+    def load(self, data):
+        # refill from a dataset.Dataset (resuming), with its most recent transitions
+        records = data.tail(self.capacity)
+        n = len(records)
+        for name in ("states", "actions", "next_states", "rewards", "dones"):
+            getattr(self, name)[:n] = records[name]
+        self.idx = n % self.capacity
+        self.size = n
+        self.episode_length = 0
 
     def sample(self, batch_size, device):
-        indices_to_sample = random.sample(range(len(self.states)), k=batch_size)
-        states = torch.from_numpy(np.array(self.states)[indices_to_sample]).float().to(device)
-        actions = torch.from_numpy(np.array(self.actions)[indices_to_sample]).float().to(device)
-        next_states = torch.from_numpy(np.array(self.next_states)[indices_to_sample]).float().to(device)
-        rewards = torch.from_numpy(np.array(self.rewards)[indices_to_sample]).float().to(device)
-        dones = torch.from_numpy(np.array(self.dones)[indices_to_sample]).float().to(device)
-
-        return states, actions, next_states, rewards, dones
+        indices = np.random.randint(0, self.size, size=batch_size)
+        fields = (self.states, self.actions, self.next_states, self.rewards, self.dones)
+        pin = self.pin_memory and torch.cuda.is_available()
+        if self.batches is None or len(self.batches[0][1]) != batch_size:
+            self.batches = [[torch.empty((batch_size,) + array.shape[1:], dtype=torch.from_numpy(array[:1]).dtype, pin_memory=pin)
+                             for array in fields] for _ in range(2)]
+            self.copies = [None, None]
+        # one set can be refilled while the copy out of the other is still running
+        self.turn ^= 1
+        batch = self.batches[self.turn]
+        if self.copies[self.turn] is not None:
+            self.copies[self.turn].synchronize()
+            self.copies[self.turn] = None
+        # gather only the batch, straight into the staging tensors
+        for array, tensor in zip(fields, batch):
+            np.take(array, indices, axis=0, out=tensor.numpy())
+        if torch.device(device).type == "cuda":
+            tensors = [tensor.to(device, non_blocking=pin) for tensor in batch]
+            if pin:
+                self.copies[self.turn] = torch.cuda.Event()
+                self.copies[self.turn].record()
+        else:
+            tensors = [tensor.clone() for tensor in batch]  # .to would hand back the staging tensors themselves
+        states, actions, next_states, rewards, dones = tensors
+        return states.float(), actions, next_states.float(), rewards, dones
 
     def __len__(self):
-        return len(self.states)
+        return self.size
 
 
 #DQN Net
 class ChessNet(nn.Module):
+    # board codes (64) in, a score for every action of the fixed action space (actions.py) and a value out.
+    # The layers are built once, a forward pass is one batched call for any number of positions
     def __init__(self, game, args):
-        # game params
-        self.board = game.getCurrentBoard()
-        self.action_size = 20    #game.getActionSize()
-        self.args = args
-
         super(ChessNet, self).__init__()
-        self.dense1 = nn.Linear(in_features=1, out_features=64)
-        self.dense2 = nn.Linear(in_features=64, out_features=64)
-        self.dense3 = nn.Linear(in_features=64, out_features=self.action_size)
-        self.dense4 = nn.Linear(in_features=self.action_size, out_features=1)
-
+        self.action_size = actions.ACTION_SIZE
+        self.args = args
+        hidden = args.get("num_channels", 512)
 
+        self.dense1 = nn.Linear(in_features=64, out_features=hidden)
+        self.dense2 = nn.Linear(in_features=hidden, out_features=hidden)
+        self.policy = nn.Linear(in_features=hidden, out_features=self.action_size)
+        self.value = nn.Linear(in_features=hidden, out_features=1)
 
-    def forward(self, x, game):
+    def forward(self, x, mask=None):
+        # x: (batch, 64) board codes, mask: (batch, ACTION_SIZE) bool, True for the legal actions
         x = F.relu(self.dense1(x))
         x = F.relu(self.dense2(x))
 
-        self.action_size = game.getActionSize()
-        self.dense3 = nn.Linear(in_features=64, out_features=self.action_size)
-        self.dense4 = nn.Linear(in_features=self.action_size, out_features=1)
+        pi = self.policy(x)
+        if mask is not None:
+            pi = pi.masked_fill(~mask, float("-inf"))
+        v = self.value(x)
 
-        pi = self.dense3(x)
-        v = self.dense4(pi)
-
-        return F.log_softmax(pi), torch.tanh(v)
+        return F.log_softmax(pi, dim=1), torch.tanh(v)
 
 
 #DQN Agent
 class NetContext():
     def __init__(self, gameState, args, discount, epsilon_min, epsilon_max, epsilon_decay, memory_cap, lossFunction):
         self.board_x, self.board_y = gameState.getBoardSize()
-        self.actionSize = gameState.getActionSize()
-        self.valid_moves = gameState.getValidMoves()
+        self.actionSize = actions.ACTION_SIZE
         self.gameState = gameState
         self.device = torch.device("cuda" if args.get("cuda") else "cpu")
 
@@ -122,7 +146,13 @@ class NetContext():
         self.epsilon_min = epsilon_min
         self.epsilon = epsilon_max
         self.epsilon_decay = epsilon_decay
-        self.replay_memory = ReplayMemory(memory_cap)
+        writer = None
+        if args.get("dataset"):
+            # experience also goes to disk, and training resumes from what is already there
+            writer = dataset.DatasetWriter(args["dataset"])
+        self.replay_memory = ReplayMemory(memory_cap, pin_memory=args.get("cuda"), writer=writer)
+        if writer is not None:
+            self.replay_memory.load(dataset.Dataset(args["dataset"]))
         self.lossFunction = lossFunction
 
         self.policyNet = ChessNet(gameState, args).to(self.device)
@@ -133,29 +163,32 @@ class NetContext():
         self.targetNet.eval()
         self.update_target()
 
+        self.state_input = torch.zeros((1, 64))
+        self.mask_input = torch.zeros((1, self.actionSize), dtype=torch.bool)
+        self.inference = None  # inference.InferenceServer to use instead of calling policyNet directly
+
     def update_target(self):
         self.targetNet.load_state_dict(self.policyNet.state_dict())
 
-    def select_action(self, state):
+    def select_action(self, state, gs=None):
+        # an action of the fixed action space, legal in gs (the agent's own game by default)
+        gs = gs or self.gameState
+        legal = list(actions.legalActions(gs))
         if random.uniform(0, 100) < self.epsilon:
-            return random.randint(0, len(self.valid_moves))
-
-
-        if not torch.is_tensor(state):
-            state = torch.FloatTensor(state).to(self.device)
+            return random.choice(legal)
 
-        with torch.no_grad():
-            action = torch.argmax(state)
-            action = action.unsqueeze(0).float()
+        if self.inference is not None:
+            # shared with the other games of this process, batched by the server
+            log_pi, value = self.inference.evaluate(np.asarray(state, dtype=np.float32), actions.legalMask(gs))
+            return int(np.argmax(log_pi))
 
+        # input and mask tensors are kept and refilled, the legal moves come from the position's cache
+        self.state_input[0] = torch.as_tensor(state, dtype=torch.float32)
+        self.mask_input.zero_()
+        self.mask_input[0, legal] = True
         with torch.no_grad():
-
-            moves, ratio = self.policyNet(action, self.gameState)
-            move = torch.argmax(moves)
-            print(move)
-            print("-")
-
-        return move.item()
+            log_pi, value = self.policyNet(self.state_input.to(self.device), self.mask_input.to(self.device))
+        return int(torch.argmax(log_pi[0]))
 
     def update_epsilon(self):
         self.epsilon = max(self.epsilon_min, self.epsilon * self.epsilon_decay)
@@ -164,27 +197,27 @@ class NetContext():
         if len(self.replay_memory) < batchsize:
             return
 
+        # policy: cross-entropy on the played action, weighted by how much better its return was than the value
+        # head expected (actor-critic), value: the return itself. next_states and dones aren't needed for either
         states, actions, next_states, rewards, dones = self.replay_memory.sample(batchsize, self.device)
-        actions = actions.reshape((-1, 1))
-        rewards = rewards.reshape((-1, 1))
-        dones = dones.reshape((-1, 1))
-
-        predicted_qs, ratio = self.policyNet(states)
-        predicted_qs = predicted_qs.gather(1, actions)
+        returns = (rewards * (2.0 / WIN_REWARD) - 1.0).clamp(-1.0, 1.0)
 
-        target_qs = self.targetNet(next_states)
-        target_qs = torch.max(target_qs, dim=1).values
-        target_qs = target_qs.reshape(-1, 1)
-        target_qs[dones] = 0.0
-        y_js = rewards + (self.discount * target_qs)
+        log_pi, values = self.policyNet(states)
+        values = values[:, 0]
+        value_loss = self.lossFunction(values, returns)
+        advantages = (returns - values).detach()
+        policy_loss = -(advantages * log_pi.gather(1, actions.reshape((-1, 1)))[:, 0]).mean()
 
-        loss = self.lossFunction(predicted_qs, y_js)
-        self.policyNet.optimizer.zero_grad()
+        loss = policy_loss + value_loss
+        self.optimizer.zero_grad()
         loss.backward()
-        self.policyNet.optimizer.step()
+        self.optimizer.step()
+        return policy_loss.item(), value_loss.item()
 
     def save(self, filename):
         torch.save(self.policyNet.state_dict(), filename)
+        if getattr(self.replay_memory, "writer", None) is not None:
+            self.replay_memory.writer.flush()  # the experience on disk catches up with the checkpoint
 
     def load(self, filename):
         self.policyNet.load_state_dict(torch.load(filename))
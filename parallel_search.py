@@ -0,0 +1,137 @@
+#!/bin/env python3
+
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import engine
+import minimax_abPrunning as minimax
+import transposition as tp
+
+''' Root splitting search: root moves are shared out between the pool's worker processes, all of them use
+    one transposition table kept in shared memory and the best root score found so far.
+    Every root move is searched with alpha = best - 1: scores are whole numbers (EVAL_NOISE off), so a
+    move as good as the best still gets its exact score and a worse one can only fail low. Taking the first
+    move with the best score in root order then gives the same move as the serial minimaxRoot at that depth. '''
+
+workerTT = None
+workerBest = None
+
+
+def initWorker(shmName, age, best):
+    global workerTT, workerBest
+    workerBest = best
+    shm = shared_memory.SharedMemory(name=shmName)
+    workerTT = tp.TranspositionTable(buffer=shm.buf, exactDepth=True)
+    workerTT.age = age
+    workerTT.shm = shm  # keep the mapping alive as long as the table
+    minimax.EVAL_NOISE = False
+
+
+def searchRootMove(task):
+    gs, index, depth, age = task
+    workerTT.age = age
+    workerTT.resetStats()
+    moves = gs.legalMoves()
+    minimax.orderMoves(moves, None, minimax.SearchInfo(), 0)
+    info = minimax.SearchInfo()
+    gs.movePiece(moves[index])
+    value = minimax.minimax(depth - 1, gs, workerBest.value - 1, 10000, False, workerTT, info, 1)
+    gs.undoMove()
+    with workerBest.get_lock():
+        if value > workerBest.value:
+            workerBest.value = value
+    return index, value, info.nodes, workerTT.probes, workerTT.hits
+
+
+class ParallelSearch():
+    def __init__(self, workers=None, sizeMB=minimax.TT_SIZE_MB):
+        self.workers = workers or mp.cpu_count()
+        self.shm = shared_memory.SharedMemory(create=True, size=tp.bufferSize(sizeMB))
+        self.shm.buf[:] = bytes(self.shm.size)
+        self.tt = tp.TranspositionTable(buffer=self.shm.buf, exactDepth=True)
+        self.best = mp.Value('i', -tp.MATE)
+        self.pool = mp.Pool(self.workers, initializer=initWorker, initargs=(self.shm.name, self.tt.age, self.best))
+        self.nodes = 0
+        self.probes = 0
+        self.hits = 0
+
+    def search(self, gs, depth):
+        ''' Same contract as minimaxRoot(depth, gs, True), returns the best move (None if there are none) '''
+        self.tt.newSearch()
+        moves = gs.legalMoves()
+        minimax.orderMoves(moves, None, minimax.SearchInfo(), 0)
+        tasks = [(gs, i, depth, self.tt.age) for i in range(len(moves))]
+        self.best.value = -tp.MATE
+        values = [None] * len(moves)
+        self.nodes = self.probes = self.hits = 0
+        for index, value, nodes, probes, hits in self.pool.imap_unordered(searchRootMove, tasks):
+            values[index] = value
+            self.nodes += nodes
+            self.probes += probes
+            self.hits += hits
+        bestMove = -tp.MATE
+        bestMoveFinal = None
+        for i in range(len(moves)):  # first best in root order, like the serial search, worse moves are only bounds
+            if values[i] > bestMove:
+                bestMove = values[i]
+                bestMoveFinal = moves[i]
+        if bestMoveFinal is not None:
+            self.tt.store(gs.hashKey, depth, bestMove, tp.EXACT, tp.packMove(bestMoveFinal))
+        self.score = bestMove
+        return bestMoveFinal
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def close(self):
+        self.pool.close()
+        self.pool.join()
+        self.tt.table.release()
+        self.shm.close()
+        self.shm.unlink()
+
+
+def serialSearch(gs, depth):
+    ''' Reference the parallel search has to agree with: deterministic evaluation, fresh table and the plain
+        minimax the workers use (the reductions of the PVS search depend on the window) '''
+    noise, usePvs = minimax.EVAL_NOISE, minimax.USE_PVS
+    minimax.EVAL_NOISE = False
+    minimax.USE_PVS = False
+    tt = tp.TranspositionTable(minimax.TT_SIZE_MB, exactDepth=True)
+    try:
+        return minimax.minimaxRoot(depth, gs, True, tt)
+    finally:
+        minimax.EVAL_NOISE, minimax.USE_PVS = noise, usePvs
+
+
+def benchmark(gs, depth, maxWorkers=None):
+    ''' Times the serial search and the parallel one with 1, 2, 4... workers, checks they agree '''
+    maxWorkers = maxWorkers or mp.cpu_count()
+    start = time.time()
+    serialMove = serialSearch(gs, depth)
+    serialTime = time.time() - start
+    print("serial: {} in {:.2f}s".format(serialMove.moveID, serialTime))
+    workers = 1
+    previousTime = None
+    while True:
+        search = ParallelSearch(workers)
+        start = time.time()
+        move = search.search(gs, depth)
+        elapsed = time.time() - start
+        search.close()
+        same = move.code == serialMove.code
+        perCore = "" if previousTime is None else ", x{:.2f} from the added cores".format(previousTime / elapsed)
+        print("{} workers: {} in {:.2f}s, speedup x{:.2f}{}, {} nodes, TT hit rate {:.1%}, matches serial: {}".format(
+            workers, move.moveID, elapsed, serialTime / elapsed, perCore, search.nodes, search.hitRate(), same))
+        previousTime = elapsed
+        if workers >= maxWorkers:
+            break
+        workers = min(workers * 2, maxWorkers)
+
+
+if __name__ == "__main__":
+    depth = int(sys.argv[1]) if len(sys.argv) > 1 else 4
+    maxWorkers = int(sys.argv[2]) if len(sys.argv) > 2 else None
+    benchmark(engine.GameState(), depth, maxWorkers)
@@ -0,0 +1,149 @@
+#!/bin/env python3
+
+import sys
+import time
+import argparse
+import multiprocessing as mp
+
+import engine
+
+''' Move generator correctness and speed check: counts the leaf nodes of the legal move tree.
+    python perft.py --depth 4 --divide             per root move counts
+    python perft.py --depth 5 --hash --processes 4  memoized subtrees, root moves spread over 4 processes
+    python perft.py --fen "<FEN>" --depth 3         any other position
+    python perft.py --suite                         positions with known counts, exits with 1 on any mismatch '''
+
+# (name, FEN, known node counts by depth), the usual perft test positions
+SUITE = [
+    ("startpos", "rnbqkbnr/pppppppp/8/8/8/8/PPPPPPPP/RNBQKBNR w KQkq - 0 1",
+     {1: 20, 2: 400, 3: 8902, 4: 197281, 5: 4865609, 6: 119060324}),
+    ("kiwipete", "r3k2r/p1ppqpb1/bn2pnp1/3PN3/1p2P3/2N2Q1p/PPPBBPPP/R3K2R w KQkq - 0 1",
+     {1: 48, 2: 2039, 3: 97862, 4: 4085603}),
+    ("position3", "8/2p5/3p4/KP5r/1R3p1k/8/4P1P1/8 w - - 0 1",
+     {1: 14, 2: 191, 3: 2812, 4: 43238, 5: 674624, 6: 11030083}),
+    ("position4", "r3k2r/Pppp1ppp/1b3nbN/nP6/BBP1P3/q4N2/Pp1P2PP/R2Q1RK1 w kq - 0 1",
+     {1: 6, 2: 264, 3: 9467, 4: 422333, 5: 15833292}),
+    ("position5", "rnbq1k1r/pp1Pbppp/2p5/8/2B5/8/PPP1NnPP/RNBQK2R w KQ - 1 8",
+     {1: 44, 2: 1486, 3: 62379, 4: 2103487}),
+    ("position6", "r4rk1/1pp1qppp/p1np1n2/2b1p1B1/2B1P1b1/P1NP1N2/1PP1QPPP/R4RK1 w - - 0 10",
+     {1: 46, 2: 2079, 3: 89890, 4: 3894594}),
+]
+
+MAX_TABLE_ENTRIES = 2000000
+
+
+def setupPosition(fen, backend):
+    gs = engine.newGameState(backend)
+    gs.loadFEN(fen)
+    return gs
+
+
+def perft(gs, depth, table=None):
+    ''' Same count as gs.countPositions(depth), table is an optional dict (hashKey, depth) -> count '''
+    if table is None:
+        return gs.countPositions(depth)
+    if depth == 0:
+        return 1
+    key = (gs.hashKey, depth)
+    if key in table:
+        return table[key]
+    moves = gs.legalMoves()
+    if depth == 1:
+        count = len(moves)
+    else:
+        count = 0
+        for move in moves:
+            gs.movePiece(move)
+            count += perft(gs, depth - 1, table)
+            gs.undoMove()
+    if len(table) >= MAX_TABLE_ENTRIES:
+        table.clear()
+    table[key] = count
+    return count
+
+
+def moveName(move):
+    return engine.packedMove(move.code).uci
+
+
+def perftRootMove(task):
+    gs, index, depth, useHash = task
+    moves = gs.legalMoves()
+    gs.movePiece(moves[index])
+    count = perft(gs, depth - 1, {} if useHash else None)
+    gs.undoMove()
+    return index, count
+
+
+def divide(gs, depth, useHash=False, processes=1):
+    ''' [(move name, count)] for every root move '''
+    moves = gs.legalMoves()
+    if processes > 1:
+        tasks = [(gs, i, depth, useHash) for i in range(len(moves))]
+        counts = [0] * len(moves)
+        with mp.Pool(processes) as pool:
+            for index, count in pool.imap_unordered(perftRootMove, tasks):
+                counts[index] = count
+    else:
+        table = {} if useHash else None
+        counts = []
+        for move in moves:
+            gs.movePiece(move)
+            counts.append(perft(gs, depth - 1, table))
+            gs.undoMove()
+    return [(moveName(moves[i]), counts[i]) for i in range(len(moves))]
+
+
+def run(gs, depth, useHash=False, processes=1, showDivide=False):
+    start = time.time()
+    if depth == 0:
+        results = []
+        nodes = 1
+    else:
+        results = divide(gs, depth, useHash, processes)
+        nodes = sum(count for name, count in results)
+    elapsed = max(time.time() - start, 1e-9)
+    if showDivide:
+        for name, count in results:
+            print("{}: {}".format(name, count))
+    print("depth {}: {} nodes in {:.2f}s ({:.0f} nodes/s)".format(depth, nodes, elapsed, nodes / elapsed))
+    return nodes, nodes / elapsed
+
+
+def runSuite(maxNodes, useHash=False, processes=1, backend="list", minNps=None):
+    failures = 0
+    for name, fen, counts in SUITE:
+        for depth in sorted(counts):
+            if counts[depth] > maxNodes:
+                continue
+            print("{} ({} backend) ".format(name, backend), end="")
+            nodes, nps = run(setupPosition(fen, backend), depth, useHash, processes)
+            if nodes != counts[depth]:
+                print("  FAIL: expected {} nodes".format(counts[depth]))
+                failures += 1
+            elif minNps is not None and nps < minNps:
+                print("  FAIL: slower than {} nodes/s".format(minNps))
+                failures += 1
+    print("{} failures".format(failures) if failures else "all passed")
+    return failures
+
+
+def main():
+    parser = argparse.ArgumentParser(description="perft for engine.GameState")
+    parser.add_argument("--depth", type=int, default=4)
+    parser.add_argument("--fen", default=SUITE[0][1], help="position to count, the start position by default")
+    parser.add_argument("--divide", action="store_true", help="print the count of every root move")
+    parser.add_argument("--hash", action="store_true", help="memoize subtree counts by zobrist key")
+    parser.add_argument("--processes", type=int, default=1, help="spread root moves over this many processes")
+    parser.add_argument("--backend", default="list", choices=["list", "bitboard"])
+    parser.add_argument("--suite", action="store_true", help="run the positions with known counts")
+    parser.add_argument("--max-nodes", type=int, default=1000000, help="skip suite entries bigger than this")
+    parser.add_argument("--min-nps", type=float, default=None, help="fail suite entries slower than this")
+    args = parser.parse_args()
+    if args.suite:
+        sys.exit(1 if runSuite(args.max_nodes, args.hash, args.processes, args.backend, args.min_nps) else 0)
+    run(setupPosition(args.fen, args.backend), args.depth, args.hash, args.processes, args.divide)
+
+
+if __name__ == "__main__":
+    main()
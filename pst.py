@@ -0,0 +1,63 @@
+#!/bin/env python3
+
+''' Material and piece-square tables in centipawns. Tables are written from white's side with row 0 being
+    the 8th rank, like GameState.board, black uses them mirrored. '''
+
+PIECE_VALUES = {"p": 100, "N": 320, "B": 330, "R": 500, "Q": 900, "K": 0}
+
+TABLES = {
+    "p": [[0,  0,  0,  0,  0,  0,  0,  0],
+          [50, 50, 50, 50, 50, 50, 50, 50],
+          [10, 10, 20, 30, 30, 20, 10, 10],
+          [5,  5, 10, 25, 25, 10,  5,  5],
+          [0,  0,  0, 20, 20,  0,  0,  0],
+          [5, -5, -10,  0,  0, -10, -5,  5],
+          [5, 10, 10, -20, -20, 10, 10,  5],
+          [0,  0,  0,  0,  0,  0,  0,  0]],
+    "N": [[-50, -40, -30, -30, -30, -30, -40, -50],
+          [-40, -20,  0,  0,  0,  0, -20, -40],
+          [-30,  0, 10, 15, 15, 10,  0, -30],
+          [-30,  5, 15, 20, 20, 15,  5, -30],
+          [-30,  0, 15, 20, 20, 15,  0, -30],
+          [-30,  5, 10, 15, 15, 10,  5, -30],
+          [-40, -20,  0,  5,  5,  0, -20, -40],
+          [-50, -40, -30, -30, -30, -30, -40, -50]],
+    "B": [[-20, -10, -10, -10, -10, -10, -10, -20],
+          [-10,  0,  0,  0,  0,  0,  0, -10],
+          [-10,  0,  5, 10, 10,  5,  0, -10],
+          [-10,  5,  5, 10, 10,  5,  5, -10],
+          [-10,  0, 10, 10, 10, 10,  0, -10],
+          [-10, 10, 10, 10, 10, 10, 10, -10],
+          [-10,  5,  0,  0,  0,  0,  5, -10],
+          [-20, -10, -10, -10, -10, -10, -10, -20]],
+    "R": [[0,  0,  0,  0,  0,  0,  0,  0],
+          [5, 10, 10, 10, 10, 10, 10,  5],
+          [-5,  0,  0,  0,  0,  0,  0, -5],
+          [-5,  0,  0,  0,  0,  0,  0, -5],
+          [-5,  0,  0,  0,  0,  0,  0, -5],
+          [-5,  0,  0,  0,  0,  0,  0, -5],
+          [-5,  0,  0,  0,  0,  0,  0, -5],
+          [0,  0,  0,  5,  5,  0,  0,  0]],
+    "Q": [[-20, -10, -10, -5, -5, -10, -10, -20],
+          [-10,  0,  0,  0,  0,  0,  0, -10],
+          [-10,  0,  5,  5,  5,  5,  0, -10],
+          [-5,  0,  5,  5,  5,  5,  0, -5],
+          [0,  0,  5,  5,  5,  5,  0, -5],
+          [-10,  5,  5,  5,  5,  5,  0, -10],
+          [-10,  0,  5,  0,  0,  0,  0, -10],
+          [-20, -10, -10, -5, -5, -10, -10, -20]],
+    "K": [[-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-30, -40, -40, -50, -50, -40, -40, -30],
+          [-20, -30, -30, -40, -40, -30, -30, -20],
+          [-10, -20, -20, -20, -20, -20, -20, -10],
+          [20, 20,  0,  0,  0,  0, 20, 20],
+          [20, 30, 10,  0,  0, 10, 30, 20]],
+}
+
+# PIECE_SQUARE[piece][row][col]: what the piece on that square adds to the score from white's point of view
+PIECE_SQUARE = {}
+for kind in PIECE_VALUES:
+    PIECE_SQUARE["w" + kind] = [[PIECE_VALUES[kind] + TABLES[kind][r][c] for c in range(8)] for r in range(8)]
+    PIECE_SQUARE["b" + kind] = [[-(PIECE_VALUES[kind] + TABLES[kind][7 - r][c]) for c in range(8)] for r in range(8)]
@@ -0,0 +1,353 @@
+#!/bin/env python3
+
+import os
+import sys
+import time
+import multiprocessing as mp
+from multiprocessing import shared_memory
+
+import numpy as np
+
+import batch_env
+
+''' Self-play actors: processes playing batches of games (batch_env.BatchEnv) with their own copy of the policy
+    network and writing every finished game into a replay buffer kept in shared memory, which the learner
+    samples from. Actors wait when they are more than max_ahead transitions ahead of what the learner has
+    sampled (backpressure), and all of them stop at the end of their current step when the pool is stopped. '''
+
+DISCOUNT = 0.99
+BUFFER_FIELDS = [("states", np.int8, (64,)), ("actions", np.int32, ()), ("next_states", np.int8, (64,)),
+                 ("rewards", np.float32, ()), ("dones", np.bool_, ())]
+
+
+class SharedReplayBuffer:
+    ''' Ring buffer of transitions in one shared memory block, same sample() as neural_reinforcement.ReplayMemory.
+        Created in the learner, passed to the actor processes, which attach to it by name '''
+    def __init__(self, capacity, max_ahead=None):
+        self.capacity = capacity
+        self.max_ahead = max_ahead if max_ahead is not None else capacity
+        self.size_bytes = sum(capacity * int(np.prod(shape, dtype=int)) * np.dtype(dtype).itemsize for name, dtype, shape in BUFFER_FIELDS)
+        self.shm = shared_memory.SharedMemory(create=True, size=self.size_bytes)
+        self.owner = os.getpid()  # only the creating process unlinks the block, forked actors inherit this object
+        self.written = mp.Value('q', 0)  # transitions written since the start, the lock guards the arrays too
+        self.consumed = mp.Value('q', 0, lock=False)  # transitions handed to the learner
+        self.space = mp.Condition(self.written.get_lock())
+        self.attach()
+
+    def attach(self):
+        self.arrays = {}
+        offset = 0
+        for name, dtype, shape in BUFFER_FIELDS:
+            array = np.ndarray((self.capacity,) + shape, dtype=dtype, buffer=self.shm.buf, offset=offset)
+            self.arrays[name] = array
+            offset += array.nbytes
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state["arrays"]
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+        self.attach()
+
+    def __len__(self):
+        return min(self.written.value, self.capacity)
+
+    def store_episode(self, states, actions, next_states, rewards, dones, stop=None):
+        ''' Writes one game, waiting first while the learner is too far behind. False if stop was set meanwhile '''
+        n = len(actions)
+        with self.space:
+            # the first capacity transitions fill the buffer freely, after that the learner sets the pace
+            while self.written.value - self.consumed.value + n > self.max_ahead and self.written.value >= self.capacity:
+                if stop is not None and stop.is_set():
+                    return False
+                self.space.wait(0.1)
+            start = self.written.value % self.capacity
+            slots = (start + np.arange(n)) % self.capacity
+            for name, values in (("states", states), ("actions", actions), ("next_states", next_states),
+                                 ("rewards", rewards), ("dones", dones)):
+                self.arrays[name][slots] = values
+            self.written.value += n
+        return True
+
+    def sample_arrays(self, batch_size, rng=np.random):
+        with self.space:
+            indices = rng.randint(0, len(self), size=batch_size)
+            batch = [self.arrays[name][indices] for name, dtype, shape in BUFFER_FIELDS]
+            self.consumed.value += batch_size
+            self.space.notify_all()
+        return batch
+
+    def sample(self, batch_size, device):
+        # same dtypes as ReplayMemory.sample: float boards and rewards, int64 actions for gather, bool dones as a mask
+        import torch
+        states, actions, next_states, rewards, dones = (torch.from_numpy(array).to(device) for array in self.sample_arrays(batch_size))
+        return states.float(), actions.long(), next_states.float(), rewards.float(), dones.bool()
+
+    def close(self):
+        self.arrays = {}
+        self.shm.close()
+        if self.owner == os.getpid():
+            self.shm.unlink()
+
+
+class SharedWeights:
+    ''' Flat float32 copy of a network's state_dict in shared memory with a version number,
+        the learner publishes and every actor loads the new version when it sees one '''
+    def __init__(self, net):
+        self.numel = sum(tensor.numel() for tensor in net.state_dict().values())
+        self.shm = shared_memory.SharedMemory(create=True, size=max(4, self.numel * 4))
+        self.owner = os.getpid()
+        self.version = mp.Value('q', 0)
+        self.publish(net)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["shm"] = self.shm.name
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.shm = shared_memory.SharedMemory(name=state["shm"])
+
+    def publish(self, net):
+        flat = np.ndarray((self.numel,), dtype=np.float32, buffer=self.shm.buf)
+        with self.version.get_lock():
+            offset = 0
+            for tensor in net.state_dict().values():
+                n = tensor.numel()
+                flat[offset:offset + n] = tensor.detach().cpu().float().flatten().numpy()
+                offset += n
+            self.version.value += 1
+
+    def load_into(self, net):
+        import torch
+        flat = np.ndarray((self.numel,), dtype=np.float32, buffer=self.shm.buf)
+        with self.version.get_lock():
+            state = {}
+            offset = 0
+            for key, tensor in net.state_dict().items():
+                n = tensor.numel()
+                state[key] = torch.from_numpy(flat[offset:offset + n].copy()).view_as(tensor).to(tensor.dtype)
+                offset += n
+            version = self.version.value
+        net.load_state_dict(state)
+        return version
+
+    def close(self):
+        self.shm.close()
+        if self.owner == os.getpid():
+            self.shm.unlink()
+
+
+class RandomPolicy:
+    def act(self, observations, masks, rng):
+        return np.array([rng.choice(np.flatnonzero(mask)) for mask in masks])
+
+
+class NetPolicy:
+    ''' Picks the legal action with the highest policy output, or a random legal one with probability epsilon.
+        net_factory is called in the actor process (so it must be a top level function) '''
+    def __init__(self, net_factory, weights, epsilon=0.1, sync_every=10):
+        self.net_factory = net_factory
+        self.weights = weights
+        self.epsilon = epsilon
+        self.sync_every = sync_every  # steps between two looks at the weights version
+        self.net = None
+        self.version = -1
+        self.steps = 0
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["net"] = None
+        state["version"] = -1
+        return state
+
+    def act(self, observations, masks, rng):
+        import torch
+        if self.net is None:
+            self.net = self.net_factory()
+            self.net.eval()
+        if self.steps % self.sync_every == 0 and self.weights.version.value != self.version:
+            self.version = self.weights.load_into(self.net)
+        self.steps += 1
+        with torch.no_grad():
+            log_pi, value = self.net(torch.from_numpy(observations).float(), torch.from_numpy(masks))
+        actions = log_pi.numpy().argmax(axis=1)
+        for i in np.flatnonzero(rng.random_sample(len(actions)) < self.epsilon):
+            actions[i] = rng.choice(np.flatnonzero(masks[i]))
+        return actions
+
+
+def backfill_rewards(length, reward, discount=DISCOUNT):
+    ''' Rewards of one game: the player who made the last move gets reward, discounted back over its earlier
+        moves, the other player's moves get 0 (like ReplayMemory.store_rewards, but stops at the game start) '''
+    rewards = np.zeros(length, dtype=np.float32)
+    rewards[length - 1::-2] = reward * discount ** np.arange(len(rewards[length - 1::-2]))
+    return rewards
+
+
+def run_actor(buffer, policy, stop, games, envs_per_actor, backend, seed):
+    rng = np.random.RandomState(seed)
+    env = batch_env.BatchEnv(envs_per_actor, backend)
+    observations, masks = env.reset()
+    episodes = [[] for _ in range(envs_per_actor)]  # (state, action, next_state) of the running games
+    try:
+        while not stop.is_set():
+            actions = policy.act(observations, masks, rng)
+            next_observations, next_masks, rewards, dones = env.step(actions)
+            for i in range(envs_per_actor):
+                if not dones[i]:
+                    episodes[i].append((observations[i], actions[i], next_observations[i]))
+                    continue
+                episode = episodes[i] + [(observations[i], actions[i], env.final_observations[i].copy())]
+                episodes[i] = []
+                done = np.zeros(len(episode), dtype=bool)
+                done[-1] = True
+                if not buffer.store_episode(np.array([t[0] for t in episode]), np.array([t[1] for t in episode]),
+                                            np.array([t[2] for t in episode]), backfill_rewards(len(episode), rewards[i]),
+                                            done, stop):
+                    return
+                with games.get_lock():
+                    games.value += 1
+            observations, masks = next_observations, next_masks
+    except KeyboardInterrupt:
+        pass
+    finally:
+        buffer.close()
+        if isinstance(policy, NetPolicy):
+            policy.weights.close()
+
+
+class ActorPool:
+    def __init__(self, buffer, num_actors=None, policy=None, envs_per_actor=8, backend="list", seed=0):
+        self.buffer = buffer
+        self.num_actors = num_actors or mp.cpu_count()
+        self.policy = policy or RandomPolicy()
+        self.envs_per_actor = envs_per_actor
+        self.backend = backend
+        self.seed = seed
+        self.stop_event = mp.Event()
+        self.games = mp.Value('q', 0)
+        self.processes = []
+        self.start_time = None
+
+    def start(self):
+        self.start_time = time.time()
+        for i in range(self.num_actors):
+            process = mp.Process(target=run_actor, args=(self.buffer, self.policy, self.stop_event, self.games,
+                                                         self.envs_per_actor, self.backend, self.seed + i), daemon=True)
+            process.start()
+            self.processes.append(process)
+
+    def games_per_second(self):
+        elapsed = time.time() - self.start_time if self.start_time else 0
+        return self.games.value / elapsed if elapsed > 0 else 0.0
+
+    def stop(self, timeout=10):
+        ''' Asks every actor to stop after its current step, terminates the ones still running after timeout '''
+        self.stop_event.set()
+        with self.buffer.space:
+            self.buffer.space.notify_all()
+        for process in self.processes:
+            process.join(timeout)
+            if process.is_alive():
+                process.terminate()
+                process.join()
+        self.processes = []
+
+    def __enter__(self):
+        self.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def benchmark(num_actors=None, seconds=20, capacity=100000, batch_size=64):
+    ''' Random actors against a learner that only samples, prints games/s and the buffer fill '''
+    buffer = SharedReplayBuffer(capacity, max_ahead=capacity // 2)
+    try:
+        with ActorPool(buffer, num_actors) as pool:
+            end = time.time() + seconds
+            while time.time() < end:
+                time.sleep(1)
+                if len(buffer) >= batch_size:
+                    buffer.sample_arrays(batch_size)
+                print("{} actors: {} games, {:.2f} games/s, {} transitions in the buffer".format(
+                    pool.num_actors, pool.games.value, pool.games_per_second(), len(buffer)))
+    finally:
+        buffer.close()
+
+
+def check_learn(batch_size=16):
+    ''' One NetContext.learn step sampling from a SharedReplayBuffer, as train_parallel does. True if it ran
+        and the sampled tensors have the dtypes of ReplayMemory.sample '''
+    import torch
+    import engine
+    import actions
+    import neural_reinforcement as nr
+    rng = np.random.RandomState(0)
+    buffer = SharedReplayBuffer(4 * batch_size)
+    try:
+        n = 2 * batch_size
+        dones = np.zeros(n, dtype=bool)
+        dones[-1] = True
+        buffer.store_episode(rng.randint(-6, 7, size=(n, 64)), rng.randint(0, actions.ACTION_SIZE, size=n),
+                             rng.randint(-6, 7, size=(n, 64)), backfill_rewards(n, 1.0), dones)
+        agent = nr.NetContext(engine.GameState(), {"num_channels": 32}, 0.99, 0.01, 1.0, 0.95, n, torch.nn.MSELoss())
+        for i in range(n):
+            agent.replay_memory.store(buffer.arrays["states"][i], buffer.arrays["actions"][i],
+                                      buffer.arrays["next_states"][i], buffer.arrays["dones"][i])
+        expected = [tensor.dtype for tensor in agent.replay_memory.sample(batch_size, agent.device)]
+        got = [tensor.dtype for tensor in buffer.sample(batch_size, agent.device)]
+        agent.replay_memory = buffer
+        before = [p.detach().clone() for p in agent.policyNet.parameters()]
+        agent.learn(batch_size)
+        changed = any(not torch.equal(a, p) for a, p in zip(before, agent.policyNet.parameters()))
+    finally:
+        buffer.close()
+    print("sample dtypes {}, ReplayMemory {}: {}".format(got, expected, "ok" if got == expected else "FAIL"))
+    print("learn step on the shared buffer: {}".format("ok" if changed else "FAIL, the weights did not change"))
+    return got == expected and changed
+
+
+def check_sample(batch_size=16, calls=4):
+    ''' ReplayMemory.sample on the CPU and, when there is one, on CUDA with pinned staging tensors: a batch has to
+        hold the sampled transitions and keep them through the next calls. True if it does '''
+    import torch
+    import actions
+    import neural_reinforcement as nr
+    rng = np.random.RandomState(0)
+    memory = nr.ReplayMemory(4 * batch_size, pin_memory=True)
+    for i in range(4 * batch_size):
+        memory.store(rng.randint(-6, 7, size=64), rng.randint(0, actions.ACTION_SIZE), rng.randint(-6, 7, size=64), rng.random_sample() < 0.1)
+    memory.rewards[:] = rng.random_sample(len(memory.rewards))
+    ok = True
+    for device in ["cpu"] + (["cuda"] if torch.cuda.is_available() else []):
+        np.random.seed(1)
+        indices = np.random.randint(0, memory.size, size=batch_size)
+        np.random.seed(1)
+        batch = memory.sample(batch_size, device)
+        expected = [torch.from_numpy(array[indices]) for array in (memory.states, memory.actions, memory.next_states,
+                                                                    memory.rewards, memory.dones)]
+        expected[0], expected[2] = expected[0].float(), expected[2].float()
+        for _ in range(calls):  # refills both staging sets
+            memory.sample(batch_size, device)
+        if device == "cuda":
+            torch.cuda.synchronize()
+        same = all(torch.equal(tensor.cpu(), values) for tensor, values in zip(batch, expected))
+        print("sample on {}: {}".format(device, "ok" if same else "FAIL, the batch changed under the caller"))
+        ok &= same
+    return ok
+
+
+if __name__ == "__main__":
+    # python selfplay.py [actors] [seconds]  |  python selfplay.py check
+    if len(sys.argv) > 1 and sys.argv[1] == "check":
+        results = [check_learn(), check_sample()]
+        sys.exit(0 if all(results) else 1)
+    benchmark(int(sys.argv[1]) if len(sys.argv) > 1 else None, int(sys.argv[2]) if len(sys.argv) > 2 else 20)
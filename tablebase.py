@@ -0,0 +1,305 @@
+#!/bin/env python3
+
+import os
+import sys
+import time
+import multiprocessing as mp
+
+import numpy as np
+
+''' Endgame tablebases for king and one piece against king (KQK, KRK, KPK), made by retrograde analysis.
+    A position is index ((sideToMove * 64 + whiteKing) * 64 + blackKing) * 64 + piece, with white the side that
+    has the piece (probes of the mirrored positions flip the board) and squares row * 8 + col as in engine.
+    Generation: worker processes list the successors of every position, a chunk of positions at a time, each
+    chunk is saved in the work directory as it is done, so an interrupted generation picks up where it was.
+    The table is then solved by repeating one ply of minimax over all positions until nothing changes.
+    A table file: header | WDL, 2 bits a position (0 illegal, 1 loss, 2 draw, 3 win, for the side to move)
+                  | DTM, one byte a position (plies to mate with best play, 0 for draws) '''
+
+TABLES = ["KQK", "KRK", "KPK"]  # in build order, KPK needs the other two for its promotions
+TB_DIR = "tablebases"
+SIZE = 2 * 64 * 64 * 64
+CHUNKS = 64
+HEADER = np.dtype([("magic", "S4"), ("version", "<u4"), ("size", "<u8")])
+MAGIC = b"CHTB"
+VERSION = 1
+
+ILLEGAL = 0
+LOSS = 1
+DRAW = 2
+WIN = 3
+
+MATE = 1000  # solver scores: MATE - plies for a win, -(MATE - plies) for a loss
+TB_WIN = 9500  # search scores: TB_WIN - DTM, between any evaluation and a mate found by the search (transposition.MATE_BOUND)
+
+# what a successor is: a position of the same table, a draw (piece captured, minor promotion) or a promotion
+SAME = 0
+TO_DRAW = 1
+TO_KQK = 2
+TO_KRK = 3
+
+KING_MOVES = [[r2 * 8 + c2 for r2 in range(r - 1, r + 2) for c2 in range(c - 1, c + 2)
+               if 0 <= r2 < 8 and 0 <= c2 < 8 and (r2, c2) != (r, c)] for r in range(8) for c in range(8)]
+ROOK_DIRECTIONS = [(-1, 0), (1, 0), (0, -1), (0, 1)]
+QUEEN_DIRECTIONS = ROOK_DIRECTIONS + [(-1, -1), (-1, 1), (1, -1), (1, 1)]
+
+
+def rays(directions):
+    ''' For every square the squares of each direction, nearest first '''
+    result = []
+    for r in range(8):
+        for c in range(8):
+            squareRays = []
+            for dr, dc in directions:
+                ray = []
+                r2, c2 = r + dr, c + dc
+                while 0 <= r2 < 8 and 0 <= c2 < 8:
+                    ray.append(r2 * 8 + c2)
+                    r2, c2 = r2 + dr, c2 + dc
+                squareRays.append(ray)
+            result.append(squareRays)
+    return result
+
+
+RAYS = {"Q": rays(QUEEN_DIRECTIONS), "R": rays(ROOK_DIRECTIONS)}
+
+
+def kingDistance(a, b):
+    return max(abs((a >> 3) - (b >> 3)), abs((a & 7) - (b & 7)))
+
+
+def index(stm, wk, bk, p):
+    return ((stm * 64 + wk) * 64 + bk) * 64 + p
+
+
+def attacks(piece, p, target, blocker):
+    ''' Whether white's piece on p attacks target, blocker being the only other square that can be in the way '''
+    if piece == "P":
+        return p >= 8 and target in ((p - 9) if p & 7 else -1, (p - 7) if p & 7 != 7 else -1)
+    for ray in RAYS[piece][p]:
+        for s in ray:
+            if s == target:
+                return True
+            if s == blocker:
+                break
+    return False
+
+
+def successors(piece, i):
+    ''' (legal, inCheck, [(kind, index)]) of position i '''
+    stm, rest = divmod(i, 64 * 64 * 64)
+    wk, rest = divmod(rest, 64 * 64)
+    bk, p = divmod(rest, 64)
+    if wk == bk or p == wk or p == bk or kingDistance(wk, bk) <= 1 or (piece == "P" and (p < 8 or p >= 56)):
+        return False, False, []
+    blackInCheck = attacks(piece, p, bk, wk)
+    result = []
+    if stm == 0:
+        if blackInCheck:
+            return False, False, []  # black to move would be in check, white can't be the side to move
+        for t in KING_MOVES[wk]:
+            if t != p and kingDistance(t, bk) > 1:
+                result.append((SAME, index(1, t, bk, p)))
+        if piece == "P":
+            t = p - 8
+            if t != wk and t != bk:
+                if t < 8:
+                    result.append((TO_KQK, index(1, wk, bk, t)))
+                    result.append((TO_KRK, index(1, wk, bk, t)))
+                    result.append((TO_DRAW, 0))  # knight and bishop promotions
+                else:
+                    result.append((SAME, index(1, wk, bk, t)))
+                    if p >= 48 and t - 8 != wk and t - 8 != bk:
+                        result.append((SAME, index(1, wk, bk, t - 8)))
+        else:
+            for ray in RAYS[piece][p]:
+                for s in ray:
+                    if s == wk or s == bk:
+                        break
+                    result.append((SAME, index(1, wk, bk, s)))
+        return True, False, result
+    for t in KING_MOVES[bk]:
+        if kingDistance(t, wk) <= 1:
+            continue
+        if t == p:
+            result.append((TO_DRAW, 0))  # the piece is taken, king against king
+        elif not attacks(piece, p, t, wk):
+            result.append((SAME, index(0, wk, t, p)))
+    return True, blackInCheck, result
+
+
+def chunkPath(workDir, name, chunk):
+    return os.path.join(workDir, "{}-{:03d}.npz".format(name, chunk))
+
+
+def generateChunk(task):
+    ''' Successors of one chunk of positions, saved to its file. Done already if the file exists '''
+    name, chunk, workDir = task
+    path = chunkPath(workDir, name, chunk)
+    if os.path.exists(path):
+        return chunk
+    piece = name[1]
+    start, end = chunk * SIZE // CHUNKS, (chunk + 1) * SIZE // CHUNKS
+    legal = np.zeros(end - start, dtype=bool)
+    inCheck = np.zeros(end - start, dtype=bool)
+    counts = np.zeros(end - start, dtype=np.int32)
+    kinds = []
+    targets = []
+    for i in range(start, end):
+        ok, check, moves = successors(piece, i)
+        legal[i - start] = ok
+        inCheck[i - start] = check
+        counts[i - start] = len(moves)
+        for kind, target in moves:
+            kinds.append(kind)
+            targets.append(target)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, legal=legal, inCheck=inCheck, counts=counts,
+                 kinds=np.array(kinds, dtype=np.int8), targets=np.array(targets, dtype=np.int32))
+    os.replace(tmp, path)
+    return chunk
+
+
+def solve(name, workDir, others):
+    ''' Scores (MATE scale, side to move) of every position of the table from its chunk files.
+        others: scores of the tables promotions lead to, by successor kind '''
+    parts = [np.load(chunkPath(workDir, name, chunk)) for chunk in range(CHUNKS)]
+    legal = np.concatenate([part["legal"] for part in parts])
+    inCheck = np.concatenate([part["inCheck"] for part in parts])
+    counts = np.concatenate([part["counts"] for part in parts])
+    kinds = np.concatenate([part["kinds"] for part in parts])
+    targets = np.concatenate([part["targets"] for part in parts])
+
+    scores = np.zeros(SIZE, dtype=np.int32)
+    scores[legal & (counts == 0) & inCheck] = -MATE  # checkmated, no legal moves without check is stalemate
+    external = np.zeros(len(targets), dtype=np.int32)  # successor scores that don't depend on this table
+    for kind, otherScores in others.items():
+        where = kinds == kind
+        external[where] = otherScores[targets[where]]
+    same = kinds == SAME
+    sameTargets = targets[same]
+    moving = counts > 0
+    starts = (np.cumsum(counts) - counts)[moving]
+    while True:
+        child = external.copy()
+        child[same] = scores[sameTargets]
+        candidate = -child
+        candidate -= np.sign(candidate)  # one more ply to the mate, on either side
+        best = np.maximum.reduceat(candidate, starts)
+        if np.array_equal(best, scores[moving]):
+            break
+        scores[moving] = best
+    scores[~legal] = 0
+    return scores, legal
+
+
+def writeTable(path, scores, legal):
+    wdl = np.where(~legal, ILLEGAL, np.where(scores > 0, WIN, np.where(scores < 0, LOSS, DRAW))).astype(np.uint8)
+    dtm = np.where(scores != 0, MATE - np.abs(scores), 0).astype(np.uint8)
+    packed = wdl[0::4] | wdl[1::4] << 2 | wdl[2::4] << 4 | wdl[3::4] << 6
+    header = np.zeros(1, dtype=HEADER)
+    header[0] = (MAGIC, VERSION, SIZE)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        for part in (header, packed, dtm):
+            f.write(part.tobytes())
+    os.replace(tmp, path)
+
+
+class Table():
+    def __init__(self, path):
+        self.data = np.memmap(path, dtype=np.uint8, mode="r")
+        header = self.data[:HEADER.itemsize].view(HEADER)[0]
+        if header["magic"] != MAGIC or header["version"] != VERSION or header["size"] != SIZE:
+            raise ValueError("{} is not a tablebase".format(path))
+        self.wdl = self.data[HEADER.itemsize:HEADER.itemsize + SIZE // 4]
+        self.dtm = self.data[HEADER.itemsize + SIZE // 4:HEADER.itemsize + SIZE // 4 + SIZE]
+
+    def probe(self, i):
+        ''' (WIN/DRAW/LOSS/ILLEGAL, DTM) of position i '''
+        return (int(self.wdl[i >> 2]) >> ((i & 3) * 2)) & 3, int(self.dtm[i])
+
+    def scores(self):
+        ''' Solver scores of every position, what a table built later needs from this one '''
+        wdl = np.stack([(self.wdl >> shift) & 3 for shift in (0, 2, 4, 6)], axis=1).reshape(-1)
+        dtm = self.dtm.astype(np.int32)
+        return np.where(wdl == WIN, MATE - dtm, np.where(wdl == LOSS, dtm - MATE, 0))
+
+
+def generate(names=TABLES, directory=TB_DIR, processes=None):
+    ''' Builds the tables of names that aren't in directory yet. Can be stopped and run again '''
+    workDir = os.path.join(directory, "work")
+    os.makedirs(workDir, exist_ok=True)
+    with mp.Pool(processes) as pool:
+        for name in names:
+            path = os.path.join(directory, name + ".tb")
+            if os.path.exists(path):
+                print("{}: already built".format(name))
+                continue
+            start = time.time()
+            for done, chunk in enumerate(pool.imap_unordered(generateChunk, [(name, chunk, workDir) for chunk in range(CHUNKS)])):
+                print("\r{}: {}/{} chunks".format(name, done + 1, CHUNKS), end="", flush=True)
+            others = {}
+            if name == "KPK":
+                others = {TO_KQK: Table(os.path.join(directory, "KQK.tb")).scores(),
+                          TO_KRK: Table(os.path.join(directory, "KRK.tb")).scores()}
+            scores, legal = solve(name, workDir, others)
+            writeTable(path, scores, legal)
+            for chunk in range(CHUNKS):
+                os.remove(chunkPath(workDir, name, chunk))
+            print("\r{}: {} positions, {} won for the side to move, longest mate {} plies, {:.1f}s".format(
+                name, int(legal.sum()), int((scores > 0).sum()), int(MATE - np.abs(scores[scores != 0]).min()),
+                time.time() - start))
+
+
+tables = {}  # name -> Table, or None when the file isn't there, opened on the first probe
+
+
+def table(name):
+    if name not in tables:
+        path = os.path.join(TB_DIR, name + ".tb")
+        tables[name] = Table(path) if os.path.exists(path) else None
+    return tables[name]
+
+
+def probe(gs):
+    ''' (1 win / 0 draw / -1 loss for the side to move, DTM in plies) of gs, None when it isn't in a table '''
+    board = gs.board
+    if sum(row.count("--") for row in board) != 61:
+        return None
+    if any(vars(gs.castlingRightsLog[-1]).values()):
+        return None  # a rook that can still castle is not what the tables know
+    squares = {board[r][c]: r * 8 + c for r in range(8) for c in range(8) if board[r][c] != "--"}
+    other = [piece for piece in squares if piece[1] != "K"][0]
+    name = "K" + other[1].upper() + "K"
+    if name not in TABLES or table(name) is None:
+        return None
+    if other[0] == "w":
+        i = index(0 if gs.whiteToMove else 1, squares["wK"], squares["bK"], squares[other])
+    else:
+        # black has the piece: the same position with the colours swapped and the board upside down
+        flip = lambda sq: (7 - (sq >> 3)) * 8 + (sq & 7)
+        i = index(1 if gs.whiteToMove else 0, flip(squares["bK"]), flip(squares["wK"]), flip(squares[other]))
+    wdl, dtm = tables[name].probe(i)
+    if wdl == ILLEGAL:
+        return None
+    return wdl - DRAW, dtm
+
+
+def probeScore(gs):
+    ''' probe as a search score for the side to move, None when it isn't in a table '''
+    result = probe(gs)
+    if result is None:
+        return None
+    wdl, dtm = result
+    return wdl * (TB_WIN - dtm) if wdl else 0
+
+
+if __name__ == "__main__":
+    # python tablebase.py [processes]  |  python tablebase.py probe <FEN>
+    if len(sys.argv) > 2 and sys.argv[1] == "probe":
+        import engine
+        print(probe(engine.GameState.fromFEN(sys.argv[2])))
+    else:
+        generate(processes=int(sys.argv[1]) if len(sys.argv) > 1 else None)
@@ -0,0 +1,128 @@
+#!/bin/env python3
+
+from array import array
+
+''' Fixed size transposition table. Every entry is two unsigned 64 bit words in one flat array:
+    word 0: zobrist key XOR word 1, so an entry half written by another process never matches
+    word 1: move (16 bits) | depth (8 bits) | bound (2 bits) | age (6 bits) | score + SCORE_OFFSET (32 bits)
+    Entries are grouped in buckets of two: slot 0 keeps the deepest result (depth-preferred),
+    slot 1 always takes the newest one. Entries from older searches (other age) can always be replaced. '''
+
+EMPTY = 0
+EXACT = 1
+LOWER = 2  # score is at least this (fail high)
+UPPER = 3  # score is at most this (fail low)
+
+ENTRY_WORDS = 2
+BUCKET_WORDS = 2 * ENTRY_WORDS
+BUCKET_BYTES = BUCKET_WORDS * 8
+SCORE_OFFSET = 1 << 31
+MATE = 9999  # mated at the root, a mate found ply plies from the root scores +-(MATE - ply)
+MATE_BOUND = MATE - 256  # scores beyond this are mates, stored as the distance from the entry's own position
+
+
+def packMove(move):
+    ''' The move's 16 bit code (engine.Move.code), 0 for no move '''
+    return 0 if move is None else move.code
+
+
+def toTable(score, ply):
+    ''' A mate score of a position ply plies from the root, counted from that position instead '''
+    if score > MATE_BOUND:
+        return score + ply
+    if score < -MATE_BOUND:
+        return score - ply
+    return score
+
+
+def fromTable(score, ply):
+    if score > MATE_BOUND:
+        return score - ply
+    if score < -MATE_BOUND:
+        return score + ply
+    return score
+
+
+def bufferSize(sizeMB):
+    return max(1, sizeMB * 1024 * 1024 // BUCKET_BYTES) * BUCKET_BYTES
+
+
+class TranspositionTable():
+    ''' buffer: optional writable buffer (e.g. multiprocessing shared memory) to keep the table in,
+        exactDepth: only use entries searched to exactly the requested depth, so a fixed depth search
+        gives the same result whatever other searches left in the table '''
+    def __init__(self, sizeMB=16, buffer=None, exactDepth=False):
+        if buffer is None:
+            self.table = array('Q', bytes(bufferSize(sizeMB)))
+        else:
+            self.table = memoryview(buffer).cast('B')[:len(buffer) // BUCKET_BYTES * BUCKET_BYTES].cast('Q')
+        self.numBuckets = len(self.table) // BUCKET_WORDS
+        self.exactDepth = exactDepth
+        self.age = 0
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def clear(self):
+        self.table[:] = array('Q', bytes(self.numBuckets * BUCKET_BYTES))
+        self.age = 0
+        self.resetStats()
+
+    def newSearch(self):
+        self.age = (self.age + 1) & 63
+        self.resetStats()
+
+    def resetStats(self):
+        self.probes = 0
+        self.hits = 0
+        self.stores = 0
+
+    def probe(self, key, ply=0):
+        ''' (depth, score, bound, moveCode) stored for key or None, a mate score is given back for a search ply
+            plies from the root '''
+        self.probes += 1
+        i = (key % self.numBuckets) * BUCKET_WORDS
+        table = self.table
+        for slot in (i, i + ENTRY_WORDS):
+            data = table[slot + 1]
+            if data and table[slot] ^ data == key:
+                self.hits += 1
+                return (data >> 16) & 0xFF, fromTable((data >> 32) - SCORE_OFFSET, ply), (data >> 24) & 3, data & 0xFFFF
+        return None
+
+    def store(self, key, depth, score, bound, moveCode=0, ply=0):
+        self.stores += 1
+        score = toTable(score, ply)
+        i = (key % self.numBuckets) * BUCKET_WORDS
+        table = self.table
+        data = table[i + 1]
+        if table[i] ^ data == key or not data or ((data >> 26) & 63) != self.age or depth >= ((data >> 16) & 0xFF):
+            slot = i
+        else:
+            slot = i + ENTRY_WORDS
+        old = table[slot + 1]
+        if not moveCode and table[slot] ^ old == key:  # keep the best move we already knew
+            moveCode = old & 0xFFFF
+        data = moveCode | min(depth, 255) << 16 | bound << 24 | self.age << 26 | (int(round(score)) + SCORE_OFFSET) << 32
+        table[slot] = key ^ data
+        table[slot + 1] = data
+
+    def usable(self, entryDepth, depth):
+        return entryDepth == depth if self.exactDepth else entryDepth >= depth
+
+    def hitRate(self):
+        return self.hits / self.probes if self.probes else 0.0
+
+    def usage(self):
+        ''' Fraction of the first 1000 buckets holding an entry from the current search '''
+        used = 0
+        sample = min(1000, self.numBuckets)
+        for b in range(sample):
+            for slot in (b * BUCKET_WORDS, b * BUCKET_WORDS + ENTRY_WORDS):
+                data = self.table[slot + 1]
+                if data and ((data >> 26) & 63) == self.age:
+                    used += 1
+        return used / (2 * sample)
+
+    def stats(self):
+        return {"probes": self.probes, "hits": self.hits, "hitRate": self.hitRate(), "stores": self.stores, "usage": self.usage()}